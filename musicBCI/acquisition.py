@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+###  Gap-free acquisition from a BrainFlow board.
+
+The scripts in old/ sleep, snapshot the last samples with
+get_current_board_data (which does not remove them from the board buffer)
+and rewrite a file every tick, so samples are lost between snapshots and
+re-read within them. Acquisition drains the buffer with get_board_data on a
+short asyncio tick instead, checks the package numbers of every block,
+hands the blocks to consumers through a bounded queue and appends them to a
+CSV file in large buffered writes:
+
+    acquisition = Acquisition(board, file_path='session.csv')
+    extractor = StreamFeatureExtractor(acquisition.nsignals, acquisition.sampling_rate)
+
+    async def consume():
+        async for timestamps, samples in acquisition.blocks():
+            for vector in extractor.push(timestamps, samples):
+                ...
+
+    await asyncio.gather(acquisition.run(duration=60), consume())
+
+board is a prepared BrainFlow BoardShim (see open_brainflow_board), or a
+FakeBoard, which simulates one from synthetic_eeg without BrainFlow.
+"""
+import time
+import asyncio
+import logging
+import argparse
+import numpy as np
+from synthetic_eeg import SyntheticEEG, _format_rows
+from timing import stage
+
+logger = logging.getLogger(__name__)
+
+# Package numbers of OpenBCI boards (and of BrainFlow's synthetic board) wrap
+# around at 256
+PACKAGE_MODULO = 256
+
+
+def open_brainflow_board(board_id, serial_port=''):
+    """
+    Returns a prepared BrainFlow BoardShim with the channel layout attributes
+    used by Acquisition (eeg_channels, timestamp_channel, package_num_channel,
+    sampling_rate), e.g. open_brainflow_board(BoardIds.SYNTHETIC_BOARD.value).
+    """
+    from brainflow.board_shim import BoardShim, BrainFlowInputParams
+    params = BrainFlowInputParams()
+    params.serial_port = serial_port
+    board = BoardShim(board_id, params)
+    board.prepare_session()
+    board.eeg_channels = BoardShim.get_eeg_channels(board_id)
+    board.timestamp_channel = BoardShim.get_timestamp_channel(board_id)
+    board.package_num_channel = BoardShim.get_package_num_channel(board_id)
+    board.sampling_rate = BoardShim.get_sampling_rate(board_id)
+    return board
+
+
+class FakeBoard:
+    """
+    Stand-in for a BrainFlow BoardShim streaming synthetic EEG in real time.
+    Samples accumulate in an internal buffer as wall-clock time passes, and
+    get_board_data drains it, as with BrainFlow.
+
+    Parameters:
+        nsignals (int): number of EEG channels
+        sampling_rate (float): sampling rate (Hz)
+        seed (int): seed of the synthetic signals and of the simulated losses
+        loss_rate (float): probability that a drained block loses a run of
+            packages within it (to exercise the dropped counter)
+    """
+
+    def __init__(self, nsignals=4, sampling_rate=250., seed=0, loss_rate=0.):
+        self.sampling_rate = sampling_rate
+        self.package_num_channel = 0
+        self.eeg_channels = list(range(1, nsignals + 1))
+        self.timestamp_channel = nsignals + 1
+        self.loss_rate = loss_rate
+        self._seed = seed
+        self._rng = np.random.default_rng(seed)
+        self._start = None
+
+    def prepare_session(self):
+        pass
+
+    def release_session(self):
+        pass
+
+    def start_stream(self, *args):
+        self._start = time.time()
+        self._generator = SyntheticEEG(len(self.eeg_channels), self.sampling_rate,
+                                       seed=self._seed, dropout_rate=0., start_time=self._start)
+        self._produced = 0
+        self._buffer = np.empty((self.timestamp_channel + 1, 0))
+
+    def stop_stream(self):
+        # The samples buffered so far stay readable, as with BrainFlow
+        self._generate()
+        self._start = None
+
+    def _generate(self):
+        if self._start is None:
+            return
+        due = int((time.time() - self._start) * self.sampling_rate)
+        if due > self._produced:
+            timestamps, signals = self._generator.chunk(due - self._produced)
+            block = np.empty((self.timestamp_channel + 1, len(timestamps)))
+            block[self.package_num_channel] = (self._produced + np.arange(len(timestamps))) % PACKAGE_MODULO
+            block[self.eeg_channels] = signals.T
+            block[self.timestamp_channel] = timestamps
+            self._produced = due
+            self._buffer = np.concatenate([self._buffer, block], axis=1)
+
+    def get_board_data(self):
+        """
+        Returns and removes every buffered sample ([nchannels x n] array).
+        """
+        self._generate()
+        data, self._buffer = self._buffer, self._buffer[:, :0]
+        # The first and last samples of a block are kept, so that every loss
+        # shows up as a gap in the package numbers
+        if data.shape[1] > 2 and self._rng.random() < self.loss_rate:
+            start = self._rng.integers(1, data.shape[1] - 1)
+            data = np.delete(data, np.s_[start:min(start + self._rng.integers(1, 20),
+                                                   data.shape[1] - 1)], axis=1)
+        return data
+
+    def get_current_board_data(self, num_samples):
+        """
+        Returns the last num_samples samples without removing them.
+        """
+        self._generate()
+        return self._buffer[:, -num_samples:].copy()
+
+
+class Acquisition:
+    """
+    Drains a streaming board into a bounded queue of blocks and a CSV file.
+
+    Parameters:
+        board: prepared BoardShim or FakeBoard, with the eeg_channels,
+            timestamp_channel, package_num_channel and sampling_rate
+            attributes (see open_brainflow_board)
+        file_path (str): CSV file the samples are appended to, in the dataset
+            layout (timestamps, channels..., Label), or None
+        label (float): value of the Label column of the file
+        queue_size (int): maximum number of blocks waiting for consumers.
+            When it is full the oldest block is discarded (and counted as
+            overflowed): a slow consumer never stalls the acquisition.
+        poll_interval (float): seconds between two drains of the board
+        flush_samples (int): samples buffered before they are written out
+
+    Counters:
+        received: samples accepted
+        dropped: samples lost by the board (gaps in the package numbers)
+        duplicated: samples discarded because their package number repeated
+            the previous one
+        overflowed: samples discarded because the queue was full
+    """
+
+    def __init__(self, board, file_path=None, label=float('nan'), queue_size=64,
+                 poll_interval=0.05, flush_samples=16384):
+        self.board = board
+        self.file_path = file_path
+        self.label = label
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.poll_interval = poll_interval
+        self.flush_samples = flush_samples
+        self.nsignals = len(board.eeg_channels)
+        self.sampling_rate = board.sampling_rate
+
+        self.received = 0
+        self.dropped = 0
+        self.duplicated = 0
+        self.overflowed = 0
+        self._last_package = None
+        self._pending = []
+        self._npending = 0
+        self._row_format = '%.6f' + ',%.6f' * self.nsignals + ',%g\n'
+
+    def counters(self):
+        return {'received': self.received, 'dropped': self.dropped,
+                'duplicated': self.duplicated, 'overflowed': self.overflowed}
+
+    def _check(self, data):
+        # Returns the (timestamps, samples) of the new samples of a drained
+        # [nchannels x n] array, updating the counters. Samples are told
+        # apart by their package numbers only: consecutive samples may share
+        # a timestamp (the feature code allows zero time steps), so a tied
+        # timestamp is never taken for a duplicate
+        if not data.shape[1]:
+            return None
+        packages = data[self.board.package_num_channel].astype(np.int64)
+        previous = packages[0] - 1 if self._last_package is None else self._last_package
+        steps = np.diff(np.concatenate([[previous], packages])) % PACKAGE_MODULO
+        self._last_package = packages[-1]
+        # A package number repeated from the previous sample is a package
+        # sent twice; dropping it leaves the steps of the others unchanged
+        repeated = steps == 0
+        if np.any(repeated):
+            self.duplicated += int(np.count_nonzero(repeated))
+            data, steps = data[:, ~repeated], steps[~repeated]
+            if not data.shape[1]:
+                return None
+        # Every gap is smaller than PACKAGE_MODULO: the number of packages
+        # lost in a gap is its step minus one
+        self.dropped += int(np.sum((steps[steps != 1] - 1) % PACKAGE_MODULO))
+        self.received += data.shape[1]
+        return data[self.board.timestamp_channel], data[self.board.eeg_channels].T
+
+    def _publish(self, block):
+        if self.queue.full():
+            old = self.queue.get_nowait()
+            self.overflowed += len(old[0])
+        self.queue.put_nowait(block)
+
+    async def _flush(self, f):
+        if not self._pending:
+            return
+        text = ''.join(_format_rows(self._row_format, [t, s, np.full(len(t), self.label)])
+                       for t, s in self._pending)
+        self._pending = []
+        self._npending = 0
+        await asyncio.to_thread(f.write, text)
+
+    async def run(self, duration=None, stop=None):
+        """
+        Streams until duration seconds have passed or the stop event is set,
+        then stops the board, flushes the file and ends the blocks() of the
+        consumers.
+        """
+        loop = asyncio.get_running_loop()
+        end = None if duration is None else loop.time() + duration
+        f = None
+        if self.file_path is not None:
+            f = open(self.file_path, 'w', buffering=1 << 20)
+            channels = ','.join('ch%d' % i for i in range(self.nsignals))
+            f.write('timestamps,' + channels + ',Label\n')
+
+        self.board.start_stream()
+        try:
+            while not (stop is not None and stop.is_set()) and (end is None or loop.time() < end):
+                await asyncio.sleep(self.poll_interval)
+                with stage('acquire.drain'):
+                    block = self._check(self.board.get_board_data())
+                if block is None:
+                    continue
+                self._publish(block)
+                if f is not None:
+                    self._pending.append(block)
+                    self._npending += len(block[0])
+                    if self._npending >= self.flush_samples:
+                        await self._flush(f)
+        finally:
+            self.board.stop_stream()
+            # Samples that arrived during the last tick
+            block = self._check(self.board.get_board_data())
+            if block is not None:
+                self._publish(block)
+                self._pending.append(block)
+            if f is not None:
+                await self._flush(f)
+                f.close()
+            if self.queue.full():
+                self.overflowed += len(self.queue.get_nowait()[0])
+            self.queue.put_nowait(None)
+            logger.info('acquisition stopped: %s', self.counters())
+
+    async def blocks(self):
+        """
+        Yields the (timestamps, samples) blocks of the acquisition until it
+        stops. There is a single stream of blocks, shared by the consumers.
+        """
+        while True:
+            block = await self.queue.get()
+            if block is None:
+                return
+            yield block
+
+
+async def _main(args):
+    from stream_features import StreamFeatureExtractor
+    if args.board == 'fake':
+        board = FakeBoard(args.channels, args.rate)
+    else:
+        from brainflow.board_shim import BoardIds
+        board_id = {'synthetic': BoardIds.SYNTHETIC_BOARD, 'cyton': BoardIds.CYTON_BOARD}[args.board]
+        board = open_brainflow_board(board_id.value, args.serial_port)
+
+    acquisition = Acquisition(board, args.output_file)
+    extractor = StreamFeatureExtractor(acquisition.nsignals, acquisition.sampling_rate)
+    nvectors = 0
+
+    async def consume():
+        nonlocal nvectors
+        async for timestamps, samples in acquisition.blocks():
+            nvectors += len(extractor.push(timestamps, samples))
+
+    try:
+        await asyncio.gather(acquisition.run(args.duration), consume())
+    finally:
+        board.release_session()
+    print(acquisition.counters(), nvectors, 'feature vectors')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Records a board to CSV while extracting live features.')
+    parser.add_argument('output_file')
+    parser.add_argument('--board', choices=('fake', 'synthetic', 'cyton'), default='fake')
+    parser.add_argument('--serial-port', default='')
+    parser.add_argument('--duration', type=float, default=10.)
+    parser.add_argument('--channels', type=int, default=4, help='channels of the fake board')
+    parser.add_argument('--rate', type=float, default=250., help='sampling rate of the fake board')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(args))
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+###  Benchmarks of the feature extraction and of the training matrix build.
+
+Synthetic EEG recordings (in the CSV layout of the dataset) are generated for
+every channel count, then the feature_* kernels, generate_feature_vector,
+generate_feature_vectors_from_samples and gen_training_matrix are timed.
+Results are saved as JSON, and a later run is compared with a stored
+baseline to catch regressions:
+
+    python benchmark.py run -o baseline.json
+    ... change the code ...
+    python benchmark.py run -o current.json
+    python benchmark.py compare baseline.json current.json --threshold 0.1
+
+compare exits with status 1 if any benchmark got slower by more than the
+threshold (relative change of the fastest measurement, which is less noisy
+than the median on a busy machine; --stat median compares medians).
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tempfile
+import numpy as np
+import scipy.signal
+import eeg_feature_generation as efg
+from gen_train_matrix import gen_training_matrix
+from synthetic_eeg import SyntheticEEG, write_corpus
+
+CHANNELS = (4, 8, 16)
+
+
+def time_call(fn, repeat=5, min_time=0.05):
+    """
+    Times fn(): each of the repeat measurements runs fn enough times to last
+    at least min_time seconds. Returns a dict with the median and minimum
+    time per call (s), and the number of calls per measurement.
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+
+    times = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    return {'median': float(np.median(times)), 'min': float(np.min(times)), 'number': number}
+
+
+def kernel_benchmarks(recording, nsamples, period):
+    """
+    Returns {name: callable} for the feature_* kernels and
+    generate_feature_vector on the first window of a recording (a
+    [nsamples x nsignals + 1] matrix of timestamps and signals).
+    """
+    matrix = recording
+    index_1 = np.searchsorted(matrix[:, 0], matrix[0, 0] + period, side='right') - 1
+    window = scipy.signal.resample(matrix[:index_1, 1:], nsamples, axis=0)
+    timestamps = matrix[:index_1, 0]
+    h1, h2 = np.split(window, [nsamples // 2])
+    q1, q2, q3, q4 = np.split(window, [nsamples // 4, nsamples // 2, 3 * nsamples // 4])
+    _, _, covM = efg.feature_covariance_matrix(window)
+    mob, _ = efg.feature_mobility(window, timestamps)
+
+    return {
+        'feature_mean': lambda: efg.feature_mean(window),
+        'feature_stddev': lambda: efg.feature_stddev(window),
+        'feature_mean_d': lambda: efg.feature_mean_d(h1, h2),
+        'feature_mean_q': lambda: efg.feature_mean_q(q1, q2, q3, q4),
+        'feature_stddev_d': lambda: efg.feature_stddev_d(h1, h2),
+        'feature_min': lambda: efg.feature_min(window),
+        'feature_min_d': lambda: efg.feature_min_d(h1, h2),
+        'feature_max': lambda: efg.feature_max(window),
+        'feature_max_d': lambda: efg.feature_max_d(h1, h2),
+        'feature_covariance_matrix': lambda: efg.feature_covariance_matrix(window),
+        'feature_eigenvalues': lambda: efg.feature_eigenvalues(covM),
+        'feature_logcov': lambda: efg.feature_logcov(covM),
+        'feature_energy': lambda: efg.feature_energy(window),
+        'feature_entropy': lambda: efg.feature_entropy(window),
+        'feature_activity': lambda: efg.feature_activity(window),
+        'feature_mobility': lambda: efg.feature_mobility(window, timestamps),
+        'feature_complexity': lambda: efg.feature_complexity(mob, timestamps),
+        'generate_feature_vector': lambda: efg.generate_feature_vector(window, 1., timestamps),
+    }
+
+
+def run(channels=CHANNELS, sampling_rate=256., period=1., duration=60., nsamples=150,
+        repeat=5, nfiles=1):
+    """
+    Runs every benchmark for every channel count.
+
+    Parameters:
+        channels (tuple): channel counts of the synthetic recordings
+        sampling_rate (float): sampling rate (Hz)
+        period (float): window length (s)
+        duration (float): length of each recording (s)
+        nsamples (int): number of samples each window is resampled to
+        repeat (int): number of measurements per benchmark
+        nfiles (int): number of subjects (three recordings each) in the
+            gen_training_matrix run
+
+    Returns:
+        dict: settings, machine description and {name: timing} results, the
+        names being suffixed with the channel count (e.g. 'feature_mean[4ch]')
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for nsignals in channels:
+            tag = '[%dch]' % nsignals
+            timestamps, signals = SyntheticEEG(nsignals, sampling_rate).chunk(
+                int(2 * period * sampling_rate))
+            recording = np.column_stack([timestamps, signals])
+            for name, fn in kernel_benchmarks(recording, nsamples, period).items():
+                results[name + tag] = time_call(fn, repeat)
+
+            directory = os.path.join(tmp, '%dch' % nsignals)
+            file_path = write_corpus(directory, nfiles, 1, duration, nsignals, sampling_rate)[0]
+            results['matrix_from_csv_file' + tag] = time_call(
+                lambda: efg.matrix_from_csv_file(file_path, cache=False), repeat)
+            results['generate_feature_vectors_from_samples' + tag] = time_call(
+                lambda: efg.generate_feature_vectors_from_samples(
+                    file_path, nsamples, period, state=1.), repeat)
+            output_file = os.path.join(tmp, 'out.csv')
+            results['gen_training_matrix' + tag] = time_call(
+                lambda: gen_training_matrix(directory, output_file, None), repeat)
+
+    return {'settings': {'channels': list(channels), 'sampling_rate': sampling_rate,
+                         'period': period, 'duration': duration, 'nsamples': nsamples,
+                         'repeat': repeat, 'nfiles': nfiles},
+            'machine': {'python': platform.python_version(), 'numpy': np.__version__,
+                        'platform': platform.platform(), 'processor': platform.processor()},
+            'results': results}
+
+
+def compare(baseline, current, threshold=0.1, stat='min'):
+    """
+    Compares the times ('min' or 'median' per call) of two benchmark results.
+
+    Returns:
+        list: (name, baseline time, current time, relative change) for every
+            benchmark present in both, sorted by name
+        list: names of the benchmarks slower by more than threshold
+    """
+    rows = []
+    regressions = []
+    for name in sorted(set(baseline['results']) & set(current['results'])):
+        old = baseline['results'][name][stat]
+        new = current['results'][name][stat]
+        change = new / old - 1 if old > 0 else 0.
+        rows.append((name, old, new, change))
+        if change > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the feature extraction.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('run', help='run the benchmarks and save the results as JSON')
+    p.add_argument('-o', '--output', default='benchmark.json')
+    p.add_argument('--channels', type=int, nargs='+', default=list(CHANNELS))
+    p.add_argument('--rate', type=float, default=256., help='sampling rate (Hz)')
+    p.add_argument('--period', type=float, default=1., help='window length (s)')
+    p.add_argument('--duration', type=float, default=60., help='recording length (s)')
+    p.add_argument('--nsamples', type=int, default=150)
+    p.add_argument('--repeat', type=int, default=5)
+    p = commands.add_parser('compare', help='flag regressions against a baseline')
+    p.add_argument('baseline')
+    p.add_argument('current')
+    p.add_argument('--threshold', type=float, default=0.1,
+                   help='largest allowed relative slowdown')
+    p.add_argument('--stat', choices=('min', 'median'), default='min')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.command == 'run':
+        doc = run(args.channels, args.rate, args.period, args.duration, args.nsamples,
+                  args.repeat)
+        with open(args.output, 'w') as f:
+            json.dump(doc, f, indent=2, sort_keys=True)
+        for name, r in sorted(doc['results'].items()):
+            print('%-50s %12.3f ms' % (name, 1e3 * r['median']))
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        rows, regressions = compare(baseline, current, args.threshold, args.stat)
+        for name, old, new, change in rows:
+            print('%-50s %12.3f %12.3f ms %+7.1f%%%s' % (
+                name, 1e3 * old, 1e3 * new, 100 * change,
+                '  REGRESSION' if name in regressions else ''))
+        if regressions:
+            print('%d regression(s) above %.0f%%' % (len(regressions), 100 * args.threshold))
+            sys.exit(1)
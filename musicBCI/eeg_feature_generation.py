@@ -12,34 +12,167 @@ Adapted from Jordan J. Bird, Aston University, where original script is by Dr. L
 https://github.com/jordan-bird/eeg-feature-generation
 """
 
+import os
+import re
+import hashlib
+import logging
+import itertools
+import functools
+import collections
 import numpy as np
 import scipy
 import scipy.signal
 import pywt
+from timing import stage
+
+logger = logging.getLogger(__name__)
 
 WAVELET = "db6"
 
-def matrix_from_csv_file(file_path):
+CSV_CHUNK_ROWS = 65536
+
+# Number of windows resampled and processed together
+WINDOW_BATCH = 2048
+
+def _sidecar_path(file_path, cache_dir=None, suffix='.npy'):
+    """
+    Returns the path of a binary sidecar of a CSV file, named
+    <basename>.<path digest>.<key digest><suffix>. The key is the absolute
+    path, modification time and size of the CSV, so an edited or replaced
+    recording never matches a stale sidecar; the path digest tells apart
+    same-named CSVs from different directories sharing a cache_dir.
+    """
+    stat = os.stat(file_path)
+    path = os.path.abspath(file_path)
+    key = '%s:%d:%d' % (path, stat.st_mtime_ns, stat.st_size)
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    if cache_dir is None:
+        cache_dir = os.path.dirname(path)
+    return os.path.join(cache_dir, '%s.%s.%s%s' % (os.path.basename(file_path),
+                                                   _path_digest(path), digest, suffix))
+
+def _path_digest(path):
+    return hashlib.sha1(path.encode('utf-8')).hexdigest()[:8]
+
+def _stale_sidecars(file_path, sidecar, suffix='.npy'):
+    """
+    Returns the other sidecars with the same suffix of the same CSV file in
+    the directory of sidecar: only names of the exact form _sidecar_path
+    produces, so the sidecars of other files or with other suffixes are left
+    alone.
+    """
+    pattern = re.compile(r'%s\.%s\.[0-9a-f]{16}%s$' % (
+        re.escape(os.path.basename(file_path)), _path_digest(os.path.abspath(file_path)),
+        re.escape(suffix)))
+    directory = os.path.dirname(sidecar)
+    return [os.path.join(directory, name) for name in os.listdir(directory)
+            if pattern.match(name) and os.path.join(directory, name) != sidecar]
+
+def _parse_csv_columns(file_path, keep_last=False):
+    """
+    Parses a CSV file with a header row, keeping every column but the last one
+    (unless keep_last is set, e.g. for the label column). The file is read
+    in chunks of CSV_CHUNK_ROWS lines, each parsed by np.loadtxt. Chunks with
+    malformed values fall back to np.genfromtxt, which turns them into NaN as
+    the original reader did.
+    """
+    chunks = []
+    with open(file_path, 'r') as f:
+        ncols = len(f.readline().split(','))
+        if not keep_last:
+            ncols -= 1
+        usecols = range(ncols)
+        while True:
+            lines = list(itertools.islice(f, CSV_CHUNK_ROWS))
+            if not lines:
+                break
+            try:
+                chunk = np.loadtxt(lines, delimiter=',', usecols=usecols, ndmin=2)
+            except ValueError:
+                chunk = np.genfromtxt(lines, delimiter=',', usecols=usecols)
+                chunk = chunk.reshape(-1, ncols)
+            chunks.append(chunk)
+    if not chunks:
+        return np.empty((0, ncols))
+    return np.concatenate(chunks)
+
+def matrix_from_csv_file(file_path, cache=True, cache_dir=None):
     """
 	Returns the data matrix given the path of a CSV file.
 	
+	The CSV is parsed once (only the columns that are kept, in chunks) and 
+	stored as a .npy sidecar next to it (or in cache_dir). Later calls 
+	memory-map the sidecar instead of parsing the text again, as long as the 
+	CSV keeps the same path, modification time and size.
+	
 	Parameters:
 		file_path (str): path for the CSV file with a time stamp in the first column
 			and the signals in the subsequent ones.
 			Time stamps are in seconds, with millisecond precision
+		cache (bool): whether to read and write the binary sidecar
+		cache_dir (str): directory for the sidecar. Defaults to the directory 
+			of the CSV file.
     Returns:
-		numpy.ndarray: 2D matrix containing the data read from the CSV
+		numpy.ndarray: 2D matrix containing the data read from the CSV 
+			(read-only memory map when it comes from the sidecar)
 	
 	Author: 
 		Original: [lmanso] 
 		Revision and documentation: [fcampelo]
 	
 	"""
-    csv_data = np.genfromtxt(file_path, delimiter=',')
-    full_matrix = csv_data[1:,:-1]
-    print(full_matrix.shape)
+    with stage('read'):
+        full_matrix = load_csv_columns(file_path, cache=cache, cache_dir=cache_dir)
+    logger.debug('%s: %s matrix', file_path, full_matrix.shape)
     return full_matrix
 
+def load_csv_columns(file_path, keep_last=False, cache=True, cache_dir=None,
+                     suffix='.npy', dtype=np.float64):
+    """
+    Returns the columns of a CSV file with a header row (see
+    _parse_csv_columns) through a binary sidecar: the CSV is parsed once, and
+    later calls memory-map the sidecar as long as the CSV keeps the same path,
+    modification time and size. The sidecar is written under a temporary name
+    and renamed, so a concurrent reader never sees a partial one, and the
+    stale sidecars of the file are then removed.
+
+    Parameters:
+        file_path (str): path of the CSV file
+        keep_last (bool): keep the last column (e.g. the label)
+        cache (bool): whether to read and write the sidecar
+        cache_dir (str): directory for the sidecar. Defaults to the directory
+            of the CSV file.
+        suffix (str): end of the sidecar name, which tells apart sidecars of
+            the same file holding different columns. The dtype name is added
+            before it for types other than float64.
+        dtype (numpy.dtype): type of the returned matrix
+
+    Returns:
+        numpy.ndarray: 2D matrix (read-only memory map when it comes from the
+            sidecar)
+    """
+    if not cache:
+        return _parse_csv_columns(file_path, keep_last).astype(dtype, copy=False)
+
+    dtype = np.dtype(dtype)
+    if dtype != np.float64:
+        suffix = suffix[:-len('.npy')] + '.%s.npy' % dtype.name
+    sidecar = _sidecar_path(file_path, cache_dir, suffix)
+    if not os.path.exists(sidecar):
+        matrix = _parse_csv_columns(file_path, keep_last).astype(dtype, copy=False)
+        try:
+            tmp_path = sidecar[:-len('.npy')] + '.%d.tmp' % os.getpid()
+            with open(tmp_path, 'wb') as f:
+                np.save(f, matrix)
+            os.replace(tmp_path, sidecar)
+            for stale in _stale_sidecars(file_path, sidecar, suffix):
+                os.remove(stale)
+        except OSError:
+            # Read-only dataset directory: carry on without the sidecar
+            return matrix
+
+    return np.load(sidecar, mmap_mode='r')
+
 """
 def matrix_from_bci_file(file_path):
 	# Returns the data matrix given the path of a CSV BCI file.
@@ -70,14 +203,65 @@ def get_time_slice(full_matrix, period, start=0.):
 		Reimplemented: [fcampelo]
 	"""
     rstart = full_matrix[0, 0] + start
-    print(full_matrix[0, 0], rstart)
+    logger.debug('slice from %s (recording start %s)', rstart, full_matrix[0, 0])
 
-    index_0 = np.max(np.where(full_matrix[:, 0] <= rstart))
-    index_1 = np.max(np.where(full_matrix[:, 0] <= rstart + period))
+    # Timestamps are sorted, so the last sample at or before a given time is
+    # found by bisection instead of scanning the whole column
+    index_0 = np.searchsorted(full_matrix[:, 0], rstart, side='right') - 1
+    index_1 = np.searchsorted(full_matrix[:, 0], rstart + period, side='right') - 1
     duration = full_matrix[index_1, 0] - full_matrix[index_0, 0]
     return full_matrix[index_0:index_1, :], duration
 
 
+def get_window_indices(timestamps, period, hop=None, max_gap=None):
+    """
+    Computes the start and end index of every time window of a recording in a
+    single pass over its timestamps. Window k is the slice that
+    get_time_slice(full_matrix, period, start=k * hop) would return, so
+    full_matrix[index_0[k]:index_1[k], :] is the k-th time window.
+
+    A window is marked as invalid when it is empty, shorter than 0.9 * period,
+    or contains a jump between consecutive timestamps larger than max_gap (a
+    dropout in the recording). Invalid windows are meant to be skipped: a dropout in
+    the middle of a recording no longer ends it.
+
+    Parameters:
+        timestamps (numpy.ndarray): 1D array of sorted timestamps (in seconds)
+        period (float): duration of each time window (in seconds)
+        hop (float): offset between the starts of consecutive windows (in
+            seconds). Defaults to period / 2.
+        max_gap (float): largest step between consecutive timestamps (in
+            seconds) allowed within a window. Defaults to period / 10; pass
+            numpy.inf to disable the check.
+
+    Returns:
+        numpy.ndarray: 1D array with the first index of each window
+        numpy.ndarray: 1D array with the (exclusive) last index of each window
+        numpy.ndarray: 1D boolean array, True for the windows to be used
+    """
+    if hop is None:
+        hop = 0.5 * period
+    if max_gap is None:
+        max_gap = 0.1 * period
+
+    # Offsets are accumulated the same way as repeated 't += hop' calls
+    nwindows = int((timestamps[-1] - timestamps[0]) / hop) + 2
+    offsets = np.concatenate([[0.], np.cumsum(np.full(nwindows - 1, hop))])
+    rstart = timestamps[0] + offsets
+
+    index_0 = np.searchsorted(timestamps, rstart, side='right') - 1
+    index_1 = np.searchsorted(timestamps, rstart + period, side='right') - 1
+    duration = timestamps[index_1] - timestamps[index_0]
+
+    # Number of gaps before each sample, so that a window holds a gap
+    # whenever the count changes between its first and last sample
+    ngaps = np.concatenate([[0], np.cumsum(np.diff(timestamps) > max_gap)])
+    valid = ((index_1 > index_0) & (duration >= 0.9 * period)
+             & (ngaps[index_1] == ngaps[index_0]))
+
+    return index_0, index_1, valid
+
+
 """
 The EEG data at this point has not been pre-processed. 
 Instead, I chose to extract selected features per epoch (1 second). 
@@ -347,12 +531,10 @@ def feature_logcov(covM):
     Since the matrix is symmetric, only the lower triangular elements
     (including the main diagonal) are returned.
 
-    In the unlikely case that the matrix logarithm contains complex values the
-    vector of features returned will contain the magnitude of each component
-    (the covariance matrix returned will be in its original form). Complex
-    values should not happen, as the covariance matrix is always symmetric
-    and positive semi-definite, but the guarantee of real-valued features is in
-    place anyway.
+    The covariance matrix is symmetric and positive semi-definite, so the
+    logarithm is taken through its eigendecomposition (see calc_spd_logm)
+    rather than with the general scipy.linalg.logm. The magnitude of each
+    component is returned, as in the original version.
 
     Details:
         The matrix logarithm is defined as the inverse of the matrix
@@ -379,7 +561,7 @@ def feature_logcov(covM):
     Author:
         Original: [fcampelo]
     """
-    log_cov = scipy.linalg.logm(covM)
+    log_cov = calc_spd_logm(*calc_spd_eigh(covM))
     indx = np.triu_indices(log_cov.shape[0])
     ret = np.abs(log_cov[indx])
 
@@ -432,17 +614,49 @@ def feature_eigenvalues(covM):
 
     Returns:
         numpy.ndarray: 1D array containing the eigenvalues of the covariance
-        matrix
+        matrix, in ascending order
         list: list containing feature names for the quantities calculated.
     Author:
         Original: [lmanso]
         Revision and documentation: [fcampelo]
     """
 
-    ret = np.linalg.eigvals(covM).flatten()
+    ret = calc_spd_eigh(covM)[0].flatten()
     names = ['eigenval_' + str(i) for i in range(covM.shape[0])]
     return ret, names
 
+def calc_spd_eigh(covM):
+    """
+        Eigendecomposition of symmetric positive semi-definite matrices, for a
+        single covariance matrix or a batch of them at once (one stacked
+        np.linalg.eigh call).
+
+        Eigenvalues that rounding made negative or zero are clipped to the
+        smallest positive value of the dtype, so that their logarithm stays
+        finite.
+
+        Parameters
+        ----------
+        covM: ndarray [... x nsignals x nsignals] of covariance matrices
+        Returns
+        -------
+        eigenvalues: ndarray [... x nsignals], in ascending order
+        eigenvectors: ndarray [... x nsignals x nsignals], one per column
+    """
+    eigenvalues, eigenvectors = np.linalg.eigh(covM)
+    return np.maximum(eigenvalues, np.finfo(eigenvalues.dtype).tiny), eigenvectors
+
+def calc_spd_logm(eigenvalues, eigenvectors):
+    """
+        Matrix logarithm V diag(log w) V^T of symmetric positive definite
+        matrices from their eigendecomposition (see calc_spd_eigh).
+
+        Returns
+        -------
+        ret: ndarray [... x nsignals x nsignals] of matrix logarithms
+    """
+    return (eigenvectors * np.log(eigenvalues)[..., np.newaxis, :]) @ np.swapaxes(eigenvectors, -1, -2)
+
 
 def calc_energy(data):
     """
@@ -475,6 +689,45 @@ def calc_entropy(data):
     shannon_entropy = -np.nansum(probability * np.log2(probability))
     return round(shannon_entropy, 3)
 
+def calc_wavelet_features(matrix, level=1):
+    """
+        Runs the DWT once along the sample axis of every signal (and of every
+        window, for a batch) and computes the energy and the entropy of the
+        detail coefficients at each decomposition level from that single
+        transform.
+
+        Parameters:
+            matrix: ndarray [... x nsamples x nsignals] of signal values
+            level: number of decomposition levels. Level 1 is the single-level
+                pywt.dwt used by feature_energy and feature_entropy.
+        Returns:
+            energy: ndarray [... x level x nsignals] with the energies of the
+                detail coefficients, finest level first
+            entropy: ndarray [... x level x nsignals] with the entropies of the
+                detail coefficients, finest level first
+    """
+    # wavedec returns [cA_n, cD_n, ..., cD_1]
+    details = pywt.wavedec(matrix, WAVELET, level=level, axis=-2)[:0:-1]
+    energy = np.empty(matrix.shape[:-2] + (level, matrix.shape[-1]),
+                      dtype=np.result_type(matrix.dtype, np.float32))
+    entropy = np.empty_like(energy)
+    for i, coeff_d in enumerate(details):
+        probability = np.square(coeff_d)
+        energy[..., i, :] = np.round(np.nansum(np.log2(probability), axis=-2), 3)
+        entropy[..., i, :] = np.round(-np.nansum(probability * np.log2(probability), axis=-2), 3)
+    return energy, entropy
+
+def wavelet_feature_names(prefix, nsignals, level=1):
+    """
+        Returns the names of the wavelet features calculated by
+        calc_wavelet_features, e.g. eng_0 for level 1 and eng_d2_0 for the
+        detail coefficients of level 2.
+    """
+    names = [prefix + str(i) for i in range(nsignals)]
+    for l in range(2, level + 1):
+        names += [prefix + 'd' + str(l) + '_' + str(i) for i in range(nsignals)]
+    return names
+
 def feature_energy(matrix):
     """
         Generate wavelet energy for the given timeslice matrix by channels (axis=1).
@@ -486,12 +739,7 @@ def feature_energy(matrix):
             ret: 1D ndarray of calculated energy by column.
             names: list containing feature names for the energies calculated.
     """
-    ret = []
-    for col in matrix.T:
-        data = col
-        #DWT by column
-        (data, coeff_d) = pywt.dwt(data, WAVELET)
-        ret.append(calc_energy(coeff_d))
+    ret = calc_wavelet_features(matrix)[0][0]
     names = ['eng_' + str(i) for i in range(matrix.shape[1])]
     return ret, names
 
@@ -506,12 +754,7 @@ def feature_entropy(matrix):
             ret: 1D ndarray of calculated entropy by column.
             names: list containing feature names for the energies calculated.
     """
-    ret = []
-    for col in matrix.T:
-        data = col
-        # DWT by column
-        (data, coeff_d) = pywt.dwt(data, WAVELET)
-        ret.append(calc_entropy(coeff_d))
+    ret = calc_wavelet_features(matrix)[1][0]
     names = ['ent_' + str(i) for i in range(matrix.shape[1])]
     return ret, names
 
@@ -532,6 +775,49 @@ def feature_activity(matrix):
     names = ['act_' + str(i) for i in range(matrix.shape[1])]
     return ret, names
 
+def calc_derivatives(matrix, timestamps):
+    """
+        Calculates the derivative of every signal at each data point, for a
+        single time window or a batch of them at once. Centred differences are
+        used inside the window and one-sided differences at its edges; the
+        derivative is 0 wherever the timestamps do not advance (except at the
+        first data point, as in the original per-sample loop).
+
+        Parameters
+        ----------
+        matrix: ndarray [... x nsamples x nsignals] of signal values
+        timestamps: ndarray [... x ntimestamps] of timestamps, with
+            ntimestamps >= nsamples. Only the first nsamples are used.
+        Returns
+        -------
+        ret: ndarray with the shape of matrix containing the derivatives, in
+            the floating point type of matrix (at least float32). The time
+            steps are taken in float64, so epoch timestamps keep their
+            precision.
+    """
+    nsamples = matrix.shape[-2]
+    if timestamps.shape[-1] < nsamples:
+        raise IndexError('%d timestamps given for %d samples'
+                         % (timestamps.shape[-1], nsamples))
+    t = timestamps[..., :nsamples]
+
+    dt = np.empty_like(t, dtype=float)
+    dt[..., 0] = t[..., 1] - t[..., 0]
+    dt[..., 1:-1] = t[..., 2:] - t[..., :-2]
+    dt[..., -1] = t[..., -1] - t[..., -2]
+
+    dx = np.empty_like(matrix, dtype=np.result_type(matrix.dtype, np.float32))
+    dx[..., 0, :] = matrix[..., 1, :] - matrix[..., 0, :]
+    dx[..., 1:-1, :] = matrix[..., 2:, :] - matrix[..., :-2, :]
+    dx[..., -1, :] = matrix[..., -1, :] - matrix[..., -2, :]
+
+    zero_dt = dt == 0
+    zero_dt[..., 0] = False
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ret = dx / dt[..., np.newaxis].astype(dx.dtype)
+    ret[np.broadcast_to(zero_dt[..., np.newaxis], ret.shape)] = 0.
+    return ret
+
 def calc_der(col, timestamps):
     """
         Calculates the derivative for each data point given a matrix.
@@ -544,20 +830,63 @@ def calc_der(col, timestamps):
         -------
         ret: 1D ndarray of derivatives
     """
-    ret = []
-    for i in range(col.shape[0]):
-        der = 0
-        # handle edge case
-        if i == 0:
-            der = (col[i + 1] - col[i]) / (timestamps[i + 1] - timestamps[i])
-        elif i == (len(col) - 1):
-            if not timestamps[i] - timestamps[i - 1] == 0:
-                der = (col[i] - col[i - 1]) / (timestamps[i] - timestamps[i - 1])
-        else:
-            if not timestamps[i + 1] - timestamps[i - 1] == 0:
-                der = (col[i + 1] - col[i - 1])/ (timestamps[i + 1] - timestamps[i - 1])
-        ret.append(der)
-    return ret
+    return calc_derivatives(np.asarray(col)[:, np.newaxis], np.asarray(timestamps))[:, 0]
+
+def calc_mobility(matrix, timestamps):
+    """
+        Computes the Hjorth mobility of every signal, for a single time window
+        or a batch of them at once.
+
+        Parameters
+        ----------
+        matrix: ndarray [... x nsamples x nsignals] of signal values
+        timestamps: ndarray [... x ntimestamps] of timestamps (see
+            calc_derivatives)
+        Returns
+        -------
+        ret: ndarray [... x nsignals] of mobilities
+    """
+    # Calculation for mobility from https://www.mathworks.com/matlabcentral/mlc-downloads/downloads/submissions/27561/versions/1/previews/MATS/HjorthParameters.m/index.html
+    dxV = np.var(calc_derivatives(matrix, timestamps), axis=-2)
+    ddxV = np.var(matrix, axis=-2)
+    return np.sqrt(dxV / ddxV)
+
+def calc_complexity(mobility, timestamps):
+    """
+        Computes the complexity feature from the mobilities of the signals, for
+        a single time window or a batch of them at once. The result is the same
+        as feature_complexity, including its handling of the first and last
+        signal and of timestamps that do not advance.
+
+        Parameters
+        ----------
+        mobility: ndarray [... x nsignals] of mobilities (see calc_mobility)
+        timestamps: ndarray [... x ntimestamps] of timestamps, with
+            ntimestamps >= nsignals
+        Returns
+        -------
+        ret: ndarray [... x nsignals] of complexities
+    """
+    nsignals = mobility.shape[-1]
+    t = timestamps[..., :nsignals]
+
+    dt = np.empty_like(mobility, dtype=float)
+    dt[..., 0] = t[..., 1] - t[..., 0]
+    dt[..., 1:-1] = t[..., 2:] - t[..., :-2]
+    dt[..., -1] = t[..., -1] - t[..., -2]
+
+    dm = np.empty_like(mobility, dtype=np.result_type(mobility.dtype, np.float32))
+    dm[..., 0] = mobility[..., 1]
+    dm[..., 1:-1] = mobility[..., 2:] - mobility[..., :-2]
+    dm[..., -1] = (nsignals - 1) - mobility[..., -2]
+
+    zero_dt = dt == 0
+    zero_dt[..., 0] = False
+    # Calculation for complexity from https://www.mathworks.com/matlabcentral/mlc-downloads/downloads/submissions/27561/versions/1/previews/MATS/HjorthParameters.m/index.html
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dxV = dm / dt.astype(dm.dtype)
+    dxV[zero_dt] = 0.
+    return dxV / mobility
 
 def feature_mobility(matrix, timestamps):
     """
@@ -574,36 +903,249 @@ def feature_mobility(matrix, timestamps):
     		from the input matrix
     	list: list containing feature names for the quantities calculated.
     """
-    ret = []
-    for col in matrix.T:
-        # Calculation for mobility from https://www.mathworks.com/matlabcentral/mlc-downloads/downloads/submissions/27561/versions/1/previews/MATS/HjorthParameters.m/index.html
-        dxV = np.var(calc_der(col, timestamps))
-        ddxV = np.var(col)
-        mob = np.sqrt(dxV / ddxV)
-        ret.append(mob)
+    ret = calc_mobility(matrix, np.asarray(timestamps))
     names = ['mob_' + str(i) for i in range(matrix.shape[1])]
     return ret, names
 
 def feature_complexity(mob_ret, timestamps):
-    ret = []
-    for mob in range(len(mob_ret)):
-        dxV = 0
-        # Calculation for complexity from https://www.mathworks.com/matlabcentral/mlc-downloads/downloads/submissions/27561/versions/1/previews/MATS/HjorthParameters.m/index.html
-        if mob == 0:
-            dxV = (mob_ret[1] - mob) / (timestamps[1] - timestamps[mob])
-        elif mob == len(mob_ret) - 1:
-            if not timestamps[mob] - timestamps[mob - 1] == 0:
-                dxV = (mob - mob_ret[mob - 1]) / (timestamps[mob] - timestamps[mob - 1])
-        else:
-            if not timestamps[mob + 1] - timestamps[mob - 1] == 0:
-                dxV = (mob_ret[mob + 1] - mob_ret[mob - 1]) / (timestamps[mob + 1] - timestamps[mob - 1])
-        comp = dxV / mob_ret[mob]
-        ret.append(comp)
+    ret = calc_complexity(np.asarray(mob_ret, dtype=float), np.asarray(timestamps))
 
     names = ['comp_' + str(i) for i in range(len(mob_ret))]
     return ret, names
 
-def generate_feature_vector(matrix, state, timestamps):
+"""
+Feature registry. Every feature declares how its columns are named and which
+shared intermediates it needs; the intermediates (window means and extrema,
+half-windows, quarter-window means, covariance matrices, DWT, mobility) are
+computed at most once per batch, and only when a selected feature requires
+them. Only cov, eigenvalues and logcov need the cross-products of the signals.
+"""
+
+Feature = collections.namedtuple('Feature', ['names', 'requires', 'compute'])
+
+
+class WindowBatch:
+    """
+    A batch of time windows plus the intermediates computed from it so far.
+
+    Parameters:
+        windows (numpy.ndarray): 3D [nwindows x nsamples x nsignals] array
+        timestamps (numpy.ndarray): 2D [nwindows x ntimestamps] array
+        wavelet_level (int): number of DWT levels of the wavelet features
+    """
+
+    def __init__(self, windows, timestamps, wavelet_level=1):
+        self.windows = windows
+        self.timestamps = timestamps
+        self.wavelet_level = wavelet_level
+        self.nwindows, self.nsamples, self.nsignals = windows.shape
+        self._intermediates = {}
+
+    def get(self, name):
+        """
+        Returns the intermediate called name, computing it on first use.
+        """
+        if name not in self._intermediates:
+            self._intermediates[name] = INTERMEDIATES[name](self)
+        return self._intermediates[name]
+
+
+def _halves(batch):
+    half = int(batch.nsamples / 2)
+    return batch.windows[:, :half], batch.windows[:, half:]
+
+def _quarter_means(batch):
+    n = batch.nsamples
+    bounds = [0, int(0.25 * n), int(0.50 * n), int(0.75 * n), n]
+    return [batch.windows[:, bounds[i]:bounds[i + 1]].mean(axis=1) for i in range(4)]
+
+def _covariance(batch):
+    centred = batch.windows - batch.get('mean')[:, np.newaxis]
+    return np.matmul(centred.transpose(0, 2, 1), centred) / (batch.nsamples - 1)
+
+INTERMEDIATES = {
+    'mean': lambda batch: batch.windows.mean(axis=1),
+    'min': lambda batch: batch.windows.min(axis=1),
+    'max': lambda batch: batch.windows.max(axis=1),
+    'halves': _halves,
+    'quarter_means': _quarter_means,
+    'covM': _covariance,
+    'covM_eigh': lambda batch: calc_spd_eigh(batch.get('covM')),
+    'wavelet': lambda batch: calc_wavelet_features(batch.windows, batch.wavelet_level),
+    'mobility': lambda batch: calc_mobility(batch.windows, batch.timestamps),
+}
+
+
+def _channel_names(prefix):
+    return lambda nsignals, wavelet_level: [prefix + str(i) for i in range(nsignals)]
+
+def _mean_q_names(nsignals, wavelet_level):
+    names = []
+    for i in range(4):  # for all quarter-windows
+        names += ['mean_q' + str(i + 1) + '_' + str(j) for j in range(nsignals)]
+    for i in range(3):  # for quarter-windows 1-3
+        for j in range((i + 1), 4):  # and quarter-windows (i+1)-4
+            names += ['mean_d_q' + str(i + 1) + 'q' + str(j + 1) + '_' + str(k) for k in range(nsignals)]
+    return names
+
+def _triu_names(prefix):
+    def names(nsignals, wavelet_level):
+        return [prefix + str(i) + '_' + str(j)
+                for i in range(nsignals) for j in range(i, nsignals)]
+    return names
+
+def _mean_q(batch, q_means):
+    diffs = [q_means[i] - q_means[j] for i in range(3) for j in range((i + 1), 4)]
+    return np.concatenate(q_means + diffs, axis=1)
+
+def _triu(matrices):
+    rows, cols = np.triu_indices(matrices.shape[-1])
+    return matrices[:, rows, cols]
+
+def _logcov(batch, eigh):
+    return np.abs(_triu(calc_spd_logm(*eigh)))
+
+FEATURES = {
+    'mean': Feature(_channel_names('mean_'), ('mean',),
+                    lambda batch, mean: mean),
+    'std': Feature(_channel_names('std_'), (),
+                   lambda batch: batch.windows.std(axis=1, ddof=1)),
+    'std_d': Feature(_channel_names('std_d_h2h1_'), ('halves',),
+                     lambda batch, h: h[1].std(axis=1, ddof=1) - h[0].std(axis=1, ddof=1)),
+    'mean_d': Feature(_channel_names('mean_d_h2h1_'), ('halves',),
+                      lambda batch, h: h[1].mean(axis=1) - h[0].mean(axis=1)),
+    'mean_q': Feature(_mean_q_names, ('quarter_means',), _mean_q),
+    'min': Feature(_channel_names('min_'), ('min',),
+                   lambda batch, m: m),
+    'min_d': Feature(_channel_names('min_d_h2h1_'), ('halves',),
+                     lambda batch, h: h[1].min(axis=1) - h[0].min(axis=1)),
+    'max': Feature(_channel_names('max_'), ('max',),
+                   lambda batch, m: m),
+    'max_d': Feature(_channel_names('max_d_h2h1_'), ('halves',),
+                     lambda batch, h: h[1].max(axis=1) - h[0].max(axis=1)),
+    'cov': Feature(_triu_names('covM_'), ('covM',),
+                   lambda batch, covM: _triu(covM)),
+    'eigenvalues': Feature(_channel_names('eigenval_'), ('covM_eigh',),
+                           lambda batch, eigh: eigh[0]),
+    'logcov': Feature(_triu_names('logcovM_'), ('covM_eigh',), _logcov),
+    'eng': Feature(lambda nsignals, level: wavelet_feature_names('eng_', nsignals, level),
+                   ('wavelet',), lambda batch, w: w[0].reshape(batch.nwindows, -1)),
+    'ent': Feature(lambda nsignals, level: wavelet_feature_names('ent_', nsignals, level),
+                   ('wavelet',), lambda batch, w: w[1].reshape(batch.nwindows, -1)),
+    'act': Feature(_channel_names('act_'), (),
+                   lambda batch: batch.windows.var(axis=1)),
+    'mob': Feature(_channel_names('mob_'), ('mobility',),
+                   lambda batch, mob: mob),
+    'comp': Feature(_channel_names('comp_'), ('mobility',),
+                    lambda batch, mob: calc_complexity(mob, batch.timestamps)),
+}
+
+# Features computed unless a selection is given (std, eigenvalues and logcov
+# are available but off by default)
+DEFAULT_FEATURES = ('mean', 'std_d', 'mean_d', 'mean_q', 'min', 'min_d', 'max',
+                    'max_d', 'cov', 'eng', 'ent', 'act', 'mob', 'comp')
+
+# Largest difference between the features computed in float32 and in float64
+# (dtype of generate_feature_vectors_from_samples), relative to the range of
+# the feature over a recording. Measured on 4-channel recordings with epoch
+# timestamps, with both resampling methods. 'eng' sums the log2 of squared
+# detail coefficients, which moves a lot for the rare coefficients close to 0;
+# 99% of its values are within 3e-4.
+FLOAT32_TOLERANCES = dict.fromkeys(FEATURES, 5e-6)
+FLOAT32_TOLERANCES['eng'] = 5e-2
+
+
+@functools.lru_cache(maxsize=None)
+def feature_schema(nsignals, features=DEFAULT_FEATURES, wavelet_level=1):
+    """
+    Returns the column names of the selected features, in selection order. The
+    result is cached, so the names are built once per configuration rather than
+    for every window.
+
+    Parameters:
+        nsignals (int): number of signals (columns) in each time window
+        features (tuple): names of the selected features (keys of FEATURES)
+        wavelet_level (int): number of DWT levels of the wavelet features
+
+    Returns:
+        tuple: feature names, without the label
+    """
+    unknown = [f for f in features if f not in FEATURES]
+    if unknown:
+        raise ValueError('Unknown features %s, expected any of %s'
+                         % (unknown, list(FEATURES)))
+    names = []
+    for f in features:
+        names += FEATURES[f].names(nsignals, wavelet_level)
+    return tuple(names)
+
+
+def feature_names(nsignals, state=None, wavelet_level=1, features=DEFAULT_FEATURES):
+    """
+    Returns the feature names produced by generate_feature_vector for a window
+    with nsignals signals, without computing any feature.
+
+    Parameters:
+        nsignals (int): number of signals (columns) in each time window
+        state (str/int/float): label of the windows. The 'Label' name is only
+            appended when a state is given.
+        wavelet_level (int): number of DWT levels of the wavelet features
+        features (tuple): names of the selected features (keys of FEATURES)
+
+    Returns:
+        list: list containing feature names for the features
+    """
+    names = list(feature_schema(nsignals, tuple(features), wavelet_level))
+    if state is not None:
+        names += ['Label']
+    return names
+
+
+def generate_feature_matrix(windows, state, timestamps, wavelet_level=1,
+                            features=DEFAULT_FEATURES):
+    """
+    Calculates the selected features for a batch of time windows in one pass.
+    Every statistic is an axis-wise reduction over the sample axis, and the
+    half- and quarter-windows are slices (views) of the input, so the cost per
+    call does not depend on the number of windows in Python terms. Only the
+    selected features and the intermediates they require are computed.
+
+    Parameters:
+        windows (numpy.ndarray): 3D [nwindows x nsamples x nsignals] array
+            containing the resampled signals of each time window
+        state (str/int/float): label associated with the time windows, or
+            None for unlabelled windows
+        timestamps (numpy.ndarray): 2D [nwindows x ntimestamps] array with the
+            (raw) timestamps of each window, as passed to
+            generate_feature_vector. ntimestamps must be at least nsamples.
+        wavelet_level (int): number of DWT levels of the wavelet features
+        features (tuple): names of the selected features (keys of FEATURES),
+            in column order
+
+    Returns:
+        numpy.ndarray: 2D [nwindows x nfeatures] array where row k equals
+        generate_feature_vector(windows[k], state, timestamps[k],
+        wavelet_level, features)[0], in the floating point type of windows
+        list: list containing feature names for the features
+    """
+    names = feature_names(windows.shape[2], state, wavelet_level, features)
+    batch = WindowBatch(windows, timestamps, wavelet_level)
+
+    blocks = []
+    for f in features:
+        feature = FEATURES[f]
+        with stage('feature.' + f):
+            blocks.append(feature.compute(batch, *[batch.get(r) for r in feature.requires]))
+
+    dtype = np.result_type(windows.dtype, np.float32)
+    if state is not None:
+        blocks.append(np.full((batch.nwindows, 1), state, dtype=dtype))
+
+    return np.concatenate(blocks, axis=1, dtype=dtype), names
+
+
+def generate_feature_vector(matrix, state, timestamps, wavelet_level=1,
+                            features=DEFAULT_FEATURES):
     """
 	Calculates all previously defined features and concatenates everything into 
 	a single feature vector.
@@ -613,6 +1155,12 @@ def generate_feature_vector(matrix, state, timestamps):
 		values of nsignals for a time window of length nsamples
 		state (str): label associated with the time window represented in the 
 		matrix.
+		timestamps (numpy.ndarray): 1D array with the timestamps of the window
+		wavelet_level (int): number of DWT levels for the wavelet energy and 
+		entropy features. Levels beyond the first add new columns.
+		features (tuple): names of the features to calculate, in column 
+		order. See FEATURES and DEFAULT_FEATURES; e.g. adding 'std', 
+		'eigenvalues' or 'logcov' turns those features on.
 		
 	Returns:
 		numpy.ndarray: 1D array containing all features
@@ -621,87 +1169,103 @@ def generate_feature_vector(matrix, state, timestamps):
 		Original: [lmanso]
 		Updates and documentation: [fcampelo]
 	"""
+    ret, names = generate_feature_matrix(matrix[np.newaxis], state,
+                                         np.asarray(timestamps)[np.newaxis],
+                                         wavelet_level, features)
+    return ret[0], names
 
-    # Extract the half- and quarter-windows
-    h1, h2 = np.split(matrix, [int(matrix.shape[0] / 2)])
-    q1, q2, q3, q4 = np.split(matrix,
-                              [int(0.25 * matrix.shape[0]), int(0.50 * matrix.shape[0]), int(0.75 * matrix.shape[0])])
-
-    var_names = []
 
-    x, v = feature_mean(matrix)
-    var_names += v
-    var_values = x
+@functools.lru_cache(maxsize=64)
+def polyphase_filter(up, down):
     """
-    x, v = feature_stddev(matrix)
-    var_names += v
-    var_values = np.hstack([var_values, x])
+    Returns the anti-aliasing FIR filter that scipy.signal.resample_poly designs
+    by default for an up/down ratio. It is designed once per ratio and reused.
     """
-    x, v = feature_stddev_d(h1, h2)
-    var_names += v
-    var_values = np.hstack([var_values, x])
-
-    x, v = feature_mean_d(h1, h2)
-    var_names += v
-    var_values = np.hstack([var_values, x])
+    max_rate = max(up, down)
+    return scipy.signal.firwin(2 * 10 * max_rate + 1, 1. / max_rate,
+                               window=('kaiser', 5.0))
 
-    x, v = feature_mean_q(q1, q2, q3, q4)
-    var_names += v
-    var_values = np.hstack([var_values, x])
 
-    x, v = feature_min(matrix)
-    var_names += v
-    var_values = np.hstack([var_values, x])
-
-    x, v = feature_min_d(h1, h2)
-    var_names += v
-    var_values = np.hstack([var_values, x])
-
-    x, v = feature_max(matrix)
-    var_names += v
-    var_values = np.hstack([var_values, x])
-
-    x, v = feature_max_d(h1, h2)
-    var_names += v
-    var_values = np.hstack([var_values, x])
-
-    x, v, covM = feature_covariance_matrix(matrix)
-    var_names += v
-    var_values = np.hstack([var_values, x])
+def resample_windows(matrix, index_0, index_1, num, method='fft', dtype=np.float64):
     """
-    x, v = feature_eigenvalues(covM)
-    var_names += v
-    var_values = np.hstack([var_values, x])
-    
-    x, v, log_cov = feature_logcov(covM)
-    var_names += v
-    var_values = np.hstack([var_values, x])
-    """
-    x, v = feature_energy(matrix)
-    var_names += v
-    var_values = np.hstack([var_values, x])
+    Resamples the signals of the slices matrix[index_0[j]:index_1[j], :] to num
+    points each. Slices of equal length are stacked and resampled together by
+    a single call, so a recording costs one call per distinct window length
+    (a handful, given the jitter of the sampling clock) rather than one per
+    window.
 
-    x, v = feature_entropy(matrix)
-    var_names += v
-    var_values = np.hstack([var_values, x])
+    Parameters:
+        matrix (numpy.ndarray): 2D matrix with the timestamps in the first
+            column and the signals in the following ones
+        index_0, index_1 (array): first and (exclusive) last index of each slice
+        num (int): number of points of each resampled slice
+        method (str): 'fft' for scipy.signal.resample (Fourier method, as used
+            for every window so far) or 'polyphase' for
+            scipy.signal.resample_poly with the exact up/down ratio of each
+            slice length, which avoids the FFT's periodic edge artefacts. The
+            polyphase filters are cached per ratio (see polyphase_filter).
+        dtype (numpy.dtype): floating point type the slices are converted to
+            when they are gathered, and that the resampling runs in
 
-    x, v = feature_activity(matrix)
-    var_names += v
-    var_values = np.hstack([var_values, x])
+    Returns:
+        numpy.ndarray: 3D [nslices x num x nsignals] array of type dtype
+    """
+    with stage('resample'):
+        return _resample_windows(matrix, index_0, index_1, num, method, dtype)
+
+def _resample_windows(matrix, index_0, index_1, num, method, dtype):
+    index_0 = np.asarray(index_0)
+    lengths = np.asarray(index_1) - index_0
+    ret = np.empty((len(index_0), num, matrix.shape[1] - 1), dtype=dtype)
+    for length in np.unique(lengths):
+        group = np.flatnonzero(lengths == length)
+        stack = matrix[index_0[group, np.newaxis] + np.arange(length), 1:].astype(dtype, copy=False)
+        if method == 'fft':
+            ret[group] = scipy.signal.resample(stack, num, axis=1)
+        elif method == 'polyphase':
+            gcd = np.gcd(num, length)
+            up, down = num // gcd, length // gcd
+            window = polyphase_filter(up, down).astype(dtype, copy=False)
+            ret[group] = scipy.signal.resample_poly(stack, up, down, axis=1, window=window)
+        else:
+            raise ValueError("Unknown resampling method '%s', expected 'fft' or 'polyphase'" % method)
+    return ret
 
-    mob_ret, v = feature_mobility(matrix, timestamps)
-    var_names += v
-    var_values = np.hstack([var_values, mob_ret])
 
-    x, v = feature_complexity(mob_ret, timestamps)
-    var_names += v
-    var_values = np.hstack([var_values, x])
+def window_feature_matrix(matrix, index_0, index_1, windows, nsamples, state,
+                          wavelet_level=1, features=DEFAULT_FEATURES,
+                          resampling='fft', dtype=np.float64):
+    """
+    Computes the feature vectors of some windows of a recording: the windows
+    are resampled as a batch (see resample_windows) and their features are
+    computed by one generate_feature_matrix call.
 
-    if state != None:
-        var_values = np.hstack([var_values, np.array([state])])
-        var_names += ['Label']
+    Parameters:
+        matrix (numpy.ndarray): 2D matrix with the timestamps in the first
+            column and the signals in the following ones
+        index_0, index_1 (numpy.ndarray): windows of the recording, as returned
+            by get_window_indices
+        windows (numpy.ndarray): 1D array with the indices of the windows to
+            compute
+        nsamples (int): number of samples each window is resampled to
+        state (str/int/float): label of the windows, or None
+        wavelet_level (int): number of DWT levels of the wavelet features
+        features (tuple): names of the features to calculate (see FEATURES)
+        resampling (str): resampling method (see resample_windows)
+        dtype (numpy.dtype): floating point type of the resampled windows and
+            of the features
 
-    return var_values, var_names
+    Returns:
+        numpy.ndarray: 2D array with one feature vector per window
+        list: list containing feature names for the features
+    """
+    if np.any(index_1[windows] - index_0[windows] < nsamples):
+        raise IndexError('windows with fewer samples than nsamples=%d' % nsamples)
+    resampled = resample_windows(matrix, index_0[windows], index_1[windows],
+                                 nsamples, resampling, dtype)
+    timestamps = matrix[index_0[windows, np.newaxis] + np.arange(nsamples), 0]
+    return generate_feature_matrix(resampled, state, timestamps, wavelet_level,
+                                   features)
 
 
 """
@@ -717,17 +1281,30 @@ state: label for the feature vector
 def generate_feature_vectors_from_samples(file_path, nsamples, period=1.0,
                                           state=None,
                                           remove_redundant=False,
-                                          cols_to_ignore=None):
+                                          cols_to_ignore=None,
+                                          max_gap=None,
+                                          dtype=np.float64,
+                                          wavelet_level=1,
+                                          features=DEFAULT_FEATURES,
+                                          resampling='fft'):
     """
 	Reads data from CSV file in "file_path" and extracts statistical features 
 	for each time window of width "period". 
 	
 	Details:
 	Successive time windows overlap by period / 2. All signals are resampled to 
-	"nsample" points to maintain consistency. Notice that the removal of 
-	redundant features (regulated by "remove_redundant") is based on the 
-	feature names - therefore, if the names output by the other functions in 
-	this script are changed this routine needs to be revised.
+	"nsample" points to maintain consistency. Windows that are shorter than 
+	0.9 * period or span a timestamp gap are skipped (see get_window_indices). 
+	Notice that the removal of redundant features (regulated by 
+	"remove_redundant") is based on the feature names - therefore, if the 
+	names output by the other functions in this script are changed this 
+	routine needs to be revised.
+	
+	The windows are counted before any feature is computed, and the rows are 
+	written into a preallocated output array. Windows are resampled and their 
+	features computed in batches (see window_feature_matrix); the feature 
+	vector of each window is computed once and used both as the current half 
+	of its row and as the lag-1 half of the next one.
 	
 	Parameters:
 		file_path (str): file path to the CSV file containing the records
@@ -739,6 +1316,19 @@ def generate_feature_vectors_from_samples(file_path, nsamples, period=1.0,
 	    resulting feature vectors (redundant features are those that are 
 	    repeated due to the 1/2 period overlap between consecutive windows).
 		cols_to_ignore (array): array of columns to ignore from the input matrix
+		max_gap (float): largest step between timestamps (in seconds) allowed 
+		within a window. Defaults to period / 10.
+		dtype (numpy.dtype): floating point type of the computation and of 
+		the returned matrix: numpy.float64 (default) or numpy.float32. The 
+		recording keeps float64 timestamps (epoch seconds do not fit a 
+		float32); its signals are converted as the windows are gathered for 
+		resampling, and the resampled windows, the feature statistics and 
+		the output are then float32, with half the memory and bandwidth. 
+		See FLOAT32_TOLERANCES for how far the features drift from float64.
+		wavelet_level (int): number of DWT levels of the wavelet features
+		features (tuple): names of the features to calculate (see FEATURES)
+		resampling (str): 'fft' (default) or 'polyphase', see 
+		resample_windows.
 		 
 		
 	Returns:
@@ -751,74 +1341,49 @@ def generate_feature_vectors_from_samples(file_path, nsamples, period=1.0,
 	"""
     # Read the matrix from file
     matrix = matrix_from_csv_file(file_path)
-    # We will start at the very beginning of the file
-    t = 0.
 
-    # No previous vector is available at the start
-    previous_vector = None
-
-    # Initialise empty return object
-    ret = None
-    headers = []
-    # Until an exception is raised or a stop condition is met
-    while True:
-        # Get the next slice from the file (starting at time 't', with a
-        # duration of 'period'
-        # If an exception is raised or the slice is not as long as we expected,
-        # return the current data available
-        try:
-            s, dur = get_time_slice(matrix, period=period, start=t)
-            if cols_to_ignore is not None:
-                s = np.delete(s, cols_to_ignore, axis=1)
-        except IndexError:
-            break
-        if len(s) == 0:
-            break
-        if dur < 0.9 * period:
-            break
-
-        # Perform the resampling of the vector
-        ry, rx = scipy.signal.resample(s[:, 1:], num=nsamples,
-                                       t=s[:, 0], axis=0)
-
-        # Slide the slice by 1/2 period
-        t += 0.5 * period
-        # Compute the feature vector. We will be appending the features of the
-        # current time slice and those of the previous one.
-        # If there was no previous vector we just set it and continue
-        # with the next vector.
-        timestamps = s[:, 0]
-        r, headers = generate_feature_vector(ry, state, timestamps)
-
-        if previous_vector is not None:
-            # If there is a previous vector, the script concatenates the two
-            # vectors and adds the result to the output matrix
-            feature_vector = np.hstack([previous_vector, r])
-
-            if ret is None:
-                ret = feature_vector
-            else:
-                ret = np.vstack([ret, feature_vector])
-
-        # Store the vector of the previous window
-        previous_vector = r
-        if state is not None:
-            # Remove the label (last column) of previous vector
-            previous_vector = previous_vector[:-1]
+    # Locate every time window (sliding by 1/2 period) up front
+    with stage('slice'):
+        index_0, index_1, valid = get_window_indices(matrix[:, 0], period,
+                                                     max_gap=max_gap)
+    if cols_to_ignore is not None:
+        matrix = np.delete(matrix, cols_to_ignore, axis=1)
 
+    nsignals = matrix.shape[1] - 1
+    headers = feature_names(nsignals, state, wavelet_level, features)
+    nlag = len(headers) - 1 if state is not None else len(headers)
     feat_names = ["lag1_" + s for s in headers[:-1]] + headers
 
+    # A row is produced for every window whose previous window is also used
+    nrows = np.count_nonzero(valid[1:] & valid[:-1])
+    ret = np.empty((nrows, nlag + len(headers)), dtype=dtype)
+
+    # Feature vectors of the windows that are used, computed in batches of
+    # WINDOW_BATCH windows to bound the memory taken by the resampled signals
+    used = np.flatnonzero(valid)
+    vectors = np.empty((len(used), len(headers)), dtype=dtype)
+    for start in range(0, len(used), WINDOW_BATCH):
+        batch = used[start:start + WINDOW_BATCH]
+        vectors[start:start + len(batch)], _ = window_feature_matrix(
+            matrix, index_0, index_1, batch, nsamples, state,
+            wavelet_level, features, resampling, dtype)
+
+    # Each row is the vector of a window appended to the vector of the
+    # previous one (without its label). Windows that are too short or hold a
+    # gap are skipped, so the window after them has no row of its own.
+    position = np.cumsum(valid) - 1
+    pairs = np.flatnonzero(valid[1:] & valid[:-1]) + 1
+    ret[:, :nlag] = vectors[position[pairs - 1], :nlag]
+    ret[:, nlag:] = vectors[position[pairs]]
+
     if remove_redundant:
         # Remove redundant lag window features
         to_rm = ["lag1_mean_q3_", "lag1_mean_q4_", "lag1_mean_d_q3q4_"]
-
-        # Remove redundancies
-        for i in range(len(to_rm)):
-            for j in range(ry.shape[1]):
-                rm_str = to_rm[i] + str(j)
-                idx = feat_names.index(rm_str)
-                feat_names.pop(idx)
-                ret = np.delete(ret, idx, axis=1)
+        rm_names = set(to_rm[i] + str(j) for i in range(len(to_rm))
+                       for j in range(nsignals))
+        keep = [i for i, name in enumerate(feat_names) if name not in rm_names]
+        feat_names = [feat_names[i] for i in keep]
+        ret = ret[:, keep]
 
     # Return
     return ret, feat_names
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+###  Content-addressed cache of per-file feature matrices.
+
+gen_training_matrix stores the feature vectors of every CSV file it processes
+under a key made of the file's content hash and the extraction settings, so a
+rebuild only recomputes the files that are new or have changed. The cache is
+a directory of .npz entries capped in size; the least recently used entries
+are evicted first.
+
+Run as a script to list what a cache directory holds:
+    python feature_cache.py CACHE_DIR [--clear]
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import numpy as np
+
+# Bump when the feature extraction changes in a way the settings do not capture
+CACHE_VERSION = 1
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def file_digest(file_path, block_size=1 << 20):
+    """
+    Returns the SHA-256 hex digest of the contents of a file.
+    """
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_key(digest, settings):
+    """
+    Returns the cache key for a file digest and a dict of extraction settings
+    (nsamples, period, cols_to_ignore, remove_redundant, wavelet, state...).
+    """
+    settings = dict(settings, version=CACHE_VERSION)
+    blob = digest + json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+def _entry_path(cache_dir, key):
+    return os.path.join(cache_dir, key + '.npz')
+
+
+def load_features(cache_dir, key):
+    """
+    Returns the cached (vectors, header) for key, or None on a cache miss. A
+    hit refreshes the entry's modification time, which is what the LRU
+    eviction orders by.
+    """
+    path = _entry_path(cache_dir, key)
+    try:
+        with np.load(path, allow_pickle=False) as entry:
+            vectors = entry['vectors']
+            header = entry['header'].tolist()
+        os.utime(path)
+    except (OSError, KeyError, ValueError):
+        return None
+    return vectors, header
+
+
+def store_features(cache_dir, key, vectors, header, source='', settings=None,
+                   max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Stores the feature vectors and header of a file under key, then evicts the
+    least recently used entries until the cache fits in max_bytes.
+
+    Parameters:
+        cache_dir (str): cache directory (created if needed)
+        key (str): key returned by cache_key
+        vectors (numpy.ndarray): 2D feature matrix of the file
+        header (list): feature names
+        source (str): name of the source file, shown by list_entries
+        settings (dict): extraction settings, shown by list_entries
+        max_bytes (int): size cap of the cache directory
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _entry_path(cache_dir, key)
+    meta = json.dumps({'source': source, 'settings': settings or {}},
+                      sort_keys=True, default=str)
+
+    # Entries are written under a temporary name and renamed, so concurrent
+    # workers never read a partial file
+    tmp_path = path[:-len('.npz')] + '.%d.tmp' % os.getpid()
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, vectors=vectors, header=np.array(header), meta=np.array(meta))
+    os.replace(tmp_path, path)
+    evict(cache_dir, max_bytes)
+
+
+def _entries_by_age(cache_dir):
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.npz'):
+            continue
+        try:
+            st = os.stat(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, name))
+    entries.sort()
+    return entries
+
+
+def evict(cache_dir, max_bytes):
+    """
+    Removes the least recently used entries until the total size of the cache
+    is at most max_bytes. Returns the number of entries removed.
+    """
+    entries = _entries_by_age(cache_dir)
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, name in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+            removed += 1
+        except FileNotFoundError:
+            pass
+        total -= size
+    return removed
+
+
+def list_entries(cache_dir):
+    """
+    Returns a list of dicts describing the entries of a cache directory, most
+    recently used first: key, source file, settings, matrix shape, size in
+    bytes and last use time.
+    """
+    ret = []
+    if not os.path.isdir(cache_dir):
+        return ret
+    for mtime, size, name in reversed(_entries_by_age(cache_dir)):
+        try:
+            with np.load(os.path.join(cache_dir, name), allow_pickle=False) as entry:
+                meta = json.loads(str(entry['meta']))
+                shape = entry['vectors'].shape
+        except (OSError, KeyError, ValueError):
+            continue
+        ret.append({'key': name[:-len('.npz')], 'source': meta['source'],
+                    'settings': meta['settings'], 'shape': shape,
+                    'bytes': size, 'last_used': mtime})
+    return ret
+
+
+def clear(cache_dir):
+    """
+    Removes every entry of a cache directory.
+    """
+    return evict(cache_dir, 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Shows the contents of a feature cache directory.')
+    parser.add_argument('cache_dir')
+    parser.add_argument('--clear', action='store_true', help='remove every entry')
+    args = parser.parse_args()
+
+    if args.clear:
+        print('Removed', clear(args.cache_dir), 'entries')
+        sys.exit(0)
+
+    entries = list_entries(args.cache_dir)
+    for e in entries:
+        print('%s  %-40s %-12s %8.1f kB  %s  %s' % (
+            e['key'][:12], e['source'], 'x'.join(str(n) for n in e['shape']),
+            e['bytes'] / 1024., time.strftime('%Y-%m-%d %H:%M', time.localtime(e['last_used'])),
+            json.dumps(e['settings'], sort_keys=True)))
+    print(len(entries), 'entries,', '%.1f MB' % (sum(e['bytes'] for e in entries) / 1024. ** 2))
@@ -13,19 +13,175 @@ https://github.com/jordan-bird/eeg-feature-generation/blob/master/code/EEG_gener
 """
 import os
 import sys
+import logging
+import argparse
+import functools
+import itertools
+import collections
 import numpy as np
-from eeg_feature_generation import generate_feature_vectors_from_samples, generate_feature_vectors_from_bci
+from concurrent.futures import ProcessPoolExecutor
+from eeg_feature_generation import (generate_feature_vectors_from_samples, WAVELET,
+                                    DEFAULT_FEATURES)
+from feature_cache import (file_digest, cache_key, load_features, store_features,
+                           DEFAULT_MAX_BYTES)
+from matrix_store import MatrixStoreWriter
+from timing import TIMINGS
 
+logger = logging.getLogger(__name__)
 
-def gen_training_matrix(directory_path, output_file, cols_to_ignore):
+
+def state_from_file_name(x):
+    """
+	Returns the label encoded in a "name-state-x.csv" file name, i.e. 2. for
+	concentrating, 1. for neutral and 0. for relaxed. Exits on any other name.
+	"""
+    try:
+        name, state, _ = x[:-4].split('-')
+    except:
+        logger.error('Wrong file name %s', x)
+        sys.exit(-1)
+    if state.lower() == 'concentrating':
+        state = 2.
+    elif state.lower() == 'neutral':
+        state = 1.
+    elif state.lower() == 'relaxed':
+        state = 0.
+    else:
+        logger.error('Wrong file name %s', x)
+        sys.exit(-1)
+    return state
+
+
+def extraction_settings(cols_to_ignore, dtype=np.float64):
+    """
+	Returns the feature extraction settings of every file, as recorded in the 
+	feature cache keys and in the binary training matrix.
+	"""
+    return {'nsamples': 150,
+            'period': 1.,
+            'cols_to_ignore': cols_to_ignore,
+            'remove_redundant': False,
+            'wavelet': WAVELET,
+            'wavelet_level': 1,
+            'features': list(DEFAULT_FEATURES),
+            'resampling': 'fft',
+            'dtype': np.dtype(dtype).name}
+
+
+def process_file(full_file_path, state, cols_to_ignore, cache_dir=None,
+                 cache_max_bytes=DEFAULT_MAX_BYTES, dtype=np.float64):
+    """
+	Extracts the feature vectors of a single CSV file. Kept at module level so 
+	that it can be sent to worker processes.
+	
+	With a cache_dir, the result is looked up by the file's content hash and 
+	the extraction settings first, and stored there after a miss.
+	"""
+    settings = dict(extraction_settings(cols_to_ignore, dtype), state=state)
+
+    if cache_dir is not None:
+        key = cache_key(file_digest(full_file_path), settings)
+        cached = load_features(cache_dir, key)
+        if cached is not None:
+            return cached
+
+    vectors, header = generate_feature_vectors_from_samples(file_path=full_file_path,
+                                                            nsamples=settings['nsamples'],
+                                                            period=settings['period'],
+                                                            state=state,
+                                                            remove_redundant=settings['remove_redundant'],
+                                                            cols_to_ignore=cols_to_ignore,
+                                                            wavelet_level=settings['wavelet_level'],
+                                                            features=settings['features'],
+                                                            resampling=settings['resampling'],
+                                                            dtype=dtype)
+
+    if cache_dir is not None:
+        store_features(cache_dir, key, vectors, header,
+                       source=os.path.basename(full_file_path),
+                       settings=settings, max_bytes=cache_max_bytes)
+    return vectors, header
+
+
+def process_files(directory_path, files, cols_to_ignore, n_jobs=1, cache_dir=None,
+                  cache_max_bytes=DEFAULT_MAX_BYTES, dtype=np.float64):
+    """
+	Yields the (vectors, header) of each (file name, state) of files, in that 
+	order. With n_jobs > 1 the files are spread over a pool of worker 
+	processes, with at most two tasks per worker in flight, so that finished 
+	results never pile up in memory while an earlier file is still running.
+	"""
+    if n_jobs == 1:
+        for x, state in files:
+            logger.info('Using file %s', x)
+            result = process_file(directory_path + '/' + x, state, cols_to_ignore,
+                                  cache_dir, cache_max_bytes, dtype)
+            logger.info('resulting vector shape for the file %s', result[0].shape)
+            yield result
+        return
+
+    in_flight = 2 * (n_jobs or os.cpu_count() or 1)
+    # Progress is logged as files finish, while the results are still
+    # yielded in order. Callbacks run in the executor's thread, and next() on
+    # an itertools.count is atomic
+    done = itertools.count(1)
+
+    def log_done(x, future):
+        if not future.cancelled() and future.exception() is None:
+            logger.info('[%d/%d] Used file %s resulting vector shape %s',
+                        next(done), len(files), x, future.result()[0].shape)
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        pending = collections.deque()
+        for x, state in files:
+            future = executor.submit(process_file, directory_path + '/' + x, state,
+                                     cols_to_ignore, cache_dir, cache_max_bytes, dtype)
+            future.add_done_callback(functools.partial(log_done, x))
+            pending.append(future)
+            if len(pending) >= in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def gen_training_matrix(directory_path, output_file, cols_to_ignore, n_jobs=1,
+                        cache_dir=None, cache_max_bytes=DEFAULT_MAX_BYTES,
+                        dtype=np.float64, output_format='csv', seed=None):
     """
 	Reads the csv files in directory_path and assembles the training matrix with 
 	the features extracted using the functions from EEG_feature_extraction.
 	
+	Files are processed in sorted name order. With n_jobs > 1 the feature 
+	extraction is spread over a pool of worker processes, one file per task; 
+	the per-file results are still merged in sorted name order, so the output 
+	does not depend on which worker finishes first.
+	
+	The 'csv' output stacks every row in memory, shuffles them and writes 
+	them as text. The 'binary' output is a matrix store (see matrix_store): 
+	the rows of each file are appended to it as soon as they are computed, 
+	and the shuffle is saved as a permutation of the row indices, so memory 
+	only holds the rows of a few files whatever the size of the dataset.
+	
+	With a cache_dir, the features of each file are cached by content hash and 
+	extraction settings (see feature_cache), so a rebuild only recomputes the 
+	files that were added or changed since the last one.
+	
 	Parameters:
 		directory_path (str): directory containing the CSV files to process.
 		output_file (str): filename for the output file.
 		cols_to_ignore (list): list of columns to ignore from the CSV
+		n_jobs (int): number of worker processes. 1 processes the files in 
+		this process; None uses one worker per CPU core.
+		cache_dir (str): directory of the per-file feature cache, or None to 
+		always recompute the features.
+		cache_max_bytes (int): size cap of the cache (LRU eviction).
+		dtype (numpy.dtype): numpy.float64 (default) or numpy.float32, the 
+		type the features are computed in (see 
+		generate_feature_vectors_from_samples) and kept in up to the output 
+		file. float32 values are written with 9 significant digits, which 
+		reads back exactly.
+		output_format (str): 'csv' or 'binary'
+		seed (int): seed of the row shuffle (None for a random one)
     Returns:
 		numpy.ndarray: 2D matrix containing the data read from the CSV
 	
@@ -34,10 +190,9 @@ def gen_training_matrix(directory_path, output_file, cols_to_ignore):
 		Updates and documentation: [fcampelo]
 	"""
 
-    # Initialise return matrix
-    FINAL_MATRIX = None
-
-    for x in os.listdir(directory_path):
+    # Collect the files to process and their labels up front
+    files = []
+    for x in sorted(os.listdir(directory_path)):
 
         # Ignore non-CSV files
         if not x.lower().endswith('.csv'):
@@ -47,44 +202,79 @@ def gen_training_matrix(directory_path, output_file, cols_to_ignore):
         # [Test files should not be in the dataset directory in the first place]
         if 'test' in x.lower():
             continue
+        files.append((x, state_from_file_name(x)))
+    if not files:
+        raise ValueError('no CSV recordings found in %s' % directory_path)
+
+    results = process_files(directory_path, files, cols_to_ignore, n_jobs, cache_dir,
+                            cache_max_bytes, dtype)
+    if output_format == 'binary':
+        writer = None
         try:
-            name, state, _ = x[:-4].split('-')
-        except:
-            print('Wrong file name', x)
-            sys.exit(-1)
-        if state.lower() == 'concentrating':
-            state = 2.
-        elif state.lower() == 'neutral':
-            state = 1.
-        elif state.lower() == 'relaxed':
-            state = 0.
-        else:
-            print('Wrong file name', x)
-            sys.exit(-1)
-
-        print('Using file', x)
-        full_file_path = directory_path + '/' + x
-        vectors, header = generate_feature_vectors_from_samples(file_path=full_file_path,
-                                                                nsamples=150,
-                                                                period=1.,
-                                                                state=state,
-                                                                #remove_redundant=True,
-                                                                cols_to_ignore=cols_to_ignore)
-
-        print('resulting vector shape for the file', vectors.shape)
-
-        if FINAL_MATRIX is None:
-            FINAL_MATRIX = vectors
-        else:
-            FINAL_MATRIX = np.vstack([FINAL_MATRIX, vectors])
-
-    print('FINAL_MATRIX', FINAL_MATRIX.shape)
+            for (x, _), (vectors, header) in zip(files, results):
+                if writer is None:
+                    writer = MatrixStoreWriter(output_file, header, dtype, seed,
+                                               extraction_settings(cols_to_ignore, dtype))
+                writer.append(vectors, source=x)
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            raise
+        writer.close()
+        logger.info('FINAL_MATRIX %s', (writer.nrows, len(writer.header)))
+        return None
+    elif output_format != 'csv':
+        raise ValueError("unknown output format %r, expected 'csv' or 'binary'" % output_format)
+
+    results = list(results)
+    header = results[-1][1]
+    FINAL_MATRIX = np.vstack([vectors for vectors, _ in results])
+    logger.info('FINAL_MATRIX %s', FINAL_MATRIX.shape)
 
     # Shuffle rows
-    np.random.shuffle(FINAL_MATRIX)
+    if seed is None:
+        np.random.shuffle(FINAL_MATRIX)
+    else:
+        np.random.default_rng(seed).shuffle(FINAL_MATRIX)
 
     # Save to file
-    np.savetxt(output_file, FINAL_MATRIX, delimiter=',',
+    fmt = '%.9g' if FINAL_MATRIX.dtype == np.float32 else '%.18e'
+    np.savetxt(output_file, FINAL_MATRIX, fmt=fmt, delimiter=',',
                header=','.join(header), comments='')
 
-    return None
\ No newline at end of file
+    return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds the training matrix from a directory of name-state-x.csv recordings.')
+    parser.add_argument('directory_path')
+    parser.add_argument('output_file')
+    parser.add_argument('--ignore', type=int, nargs='*', default=None,
+                        help='columns to ignore from the CSV files')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of worker processes (0 for one per core)')
+    parser.add_argument('--cache-dir', default=None,
+                        help='directory of the per-file feature cache')
+    parser.add_argument('--cache-max-mb', type=float, default=DEFAULT_MAX_BYTES / 1024. ** 2,
+                        help='size cap of the feature cache in MB')
+    parser.add_argument('--dtype', choices=('float64', 'float32'), default='float64',
+                        help='floating point type of the features and of the output')
+    parser.add_argument('--format', choices=('csv', 'binary'), default='csv',
+                        help='text CSV, or binary matrix store written file by file')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the row shuffle')
+    parser.add_argument('--log-level', default='INFO',
+                        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'))
+    parser.add_argument('--timings', default=None, metavar='JSON_FILE',
+                        help='write the latency histograms of the pipeline stages '
+                             '(only measured in this process, i.e. with --jobs 1)')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format='%(levelname)s %(name)s: %(message)s')
+
+    gen_training_matrix(args.directory_path, args.output_file, args.ignore,
+                        n_jobs=args.jobs or None, cache_dir=args.cache_dir,
+                        cache_max_bytes=int(args.cache_max_mb * 1024 ** 2),
+                        dtype=np.dtype(args.dtype), output_format=args.format,
+                        seed=args.seed)
+    if args.timings:
+        TIMINGS.to_json(args.timings)
+        logger.info('Stage latencies:\n%s', TIMINGS.report())
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+###  Self-describing binary store of the training matrix.
+
+gen_training_matrix used to stack the feature blocks of every file in memory,
+shuffle the rows and format them as text. MatrixStoreWriter appends each
+block to a binary file as soon as it is produced, so memory holds one file's
+block at a time, and the shuffle is saved as a permutation of the row
+indices instead of moving the rows:
+
+    with MatrixStoreWriter('train.fmx', header, settings=settings) as writer:
+        for vectors in blocks:
+            writer.append(vectors, source=name)
+
+The file carries everything needed to use it: the column names, which of
+them is the label, the extraction settings and a SHA-256 checksum of the
+rows. Opening a store only parses its trailer and memory-maps the rows, so it
+takes milliseconds whatever its size, and selections are read on demand:
+
+    store = MatrixStore('train.fmx')
+    x = store.select(features=['mean_0', 'mean_1'], labels=[0., 2.])
+    rows = store.matrix[store.permutation[:1024]]
+
+File layout (little-endian):
+    magic           8 bytes, MAGIC
+    rows            nrows x ncols values of dtype, C order, from DATA_OFFSET
+    permutation     nrows int64 row indices
+    trailer         UTF-8 JSON: version, header, label column, dtype, shape,
+                    extraction settings, per-source chunks, checksum and the
+                    offsets of the sections above
+    trailer offset  uint64, the last 8 bytes of the file
+
+Run as a script to describe a store and check its checksum:
+    python matrix_store.py train.fmx --verify
+"""
+import os
+import json
+import hashlib
+import argparse
+import numpy as np
+
+MAGIC = b'MBCIFMX1'
+
+FORMAT_VERSION = 1
+
+# Rows start at a 64-byte boundary, so that the memory map is aligned
+DATA_OFFSET = 64
+
+# Bytes hashed at a time when verifying a store
+VERIFY_BLOCK = 1 << 24
+
+
+def is_matrix_store(file_path):
+    """
+    Returns whether file_path starts with the magic bytes of a matrix store.
+    """
+    with open(file_path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class MatrixStoreWriter:
+    """
+    Appends feature blocks to a matrix store. The file is written under a
+    temporary name and only takes its final name in close, so readers never
+    see a partial store.
+
+    Parameters:
+        file_path (str): path of the store
+        header (list): column names
+        dtype (numpy.dtype): type the rows are stored in
+        seed (int): seed of the row permutation written by close
+        settings (dict): extraction settings, stored as JSON
+        label (str): name of the label column, if the header has it
+    """
+
+    def __init__(self, file_path, header, dtype=np.float64, seed=None, settings=None,
+                 label='Label'):
+        self.file_path = file_path
+        self.header = list(header)
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        self.seed = seed
+        self.settings = settings or {}
+        self.label_column = self.header.index(label) if label in self.header else None
+        self.nrows = 0
+        self.chunks = []
+        self._sha256 = hashlib.sha256()
+        self._tmp_path = file_path + '.%d.tmp' % os.getpid()
+        self._f = open(self._tmp_path, 'wb')
+        self._f.write(MAGIC.ljust(DATA_OFFSET, b'\0'))
+
+    def append(self, block, source=''):
+        """
+        Writes a 2D block of rows at the end of the store.
+        """
+        block = np.ascontiguousarray(block, dtype=self.dtype)
+        if block.ndim != 2 or block.shape[1] != len(self.header):
+            raise ValueError('expected rows of %d columns, got a block of shape %s'
+                             % (len(self.header), block.shape))
+        self._f.write(block.data)
+        self._sha256.update(block.data)
+        self.chunks.append({'source': source, 'start': self.nrows, 'nrows': len(block)})
+        self.nrows += len(block)
+
+    def close(self):
+        """
+        Writes the row permutation and the trailer, and moves the store to its
+        final path.
+        """
+        permutation_offset = self._f.tell()
+        permutation = np.random.default_rng(self.seed).permutation(self.nrows)
+        self._f.write(permutation.astype('<i8').data)
+        trailer = {'version': FORMAT_VERSION, 'header': self.header,
+                   'label_column': self.label_column, 'dtype': self.dtype.str,
+                   'shape': [self.nrows, len(self.header)], 'settings': self.settings,
+                   'chunks': self.chunks, 'sha256': self._sha256.hexdigest(),
+                   'data_offset': DATA_OFFSET, 'permutation_offset': permutation_offset}
+        trailer_offset = self._f.tell()
+        self._f.write(json.dumps(trailer, sort_keys=True, default=str).encode('utf-8'))
+        self._f.write(np.uint64(trailer_offset).astype('<u8').tobytes())
+        self._f.close()
+        os.replace(self._tmp_path, self.file_path)
+
+    def abort(self):
+        """
+        Drops the partial store.
+        """
+        self._f.close()
+        os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class MatrixStore:
+    """
+    Read-only view of a matrix store: the rows and the permutation are
+    memory-mapped, nothing is read until it is used.
+
+    Parameters:
+        file_path (str): path of the store
+        verify (bool): check the checksum of the rows on opening (this reads
+            the whole file, see verify)
+
+    Attributes:
+        header (list): column names
+        label_column (int): index of the label column, or None
+        features (list): names of the other columns
+        settings (dict): extraction settings the matrix was built with
+        matrix (numpy.memmap): 2D [nrows x ncols] rows, in the order written
+        permutation (numpy.memmap): shuffled row indices
+        chunks (list): source, first row and number of rows of every block
+    """
+
+    def __init__(self, file_path, verify=False):
+        self.file_path = file_path
+        with open(file_path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('%s is not a matrix store' % file_path)
+            f.seek(-8, os.SEEK_END)
+            end = f.tell()
+            trailer_offset = int(np.frombuffer(f.read(8), '<u8')[0])
+            if not DATA_OFFSET <= trailer_offset < end:
+                raise ValueError('%s: truncated or corrupt matrix store' % file_path)
+            f.seek(trailer_offset)
+            trailer = json.loads(f.read(end - trailer_offset).decode('utf-8'))
+        if trailer['version'] > FORMAT_VERSION:
+            raise ValueError('%s: matrix store version %d is newer than this reader (%d)'
+                             % (file_path, trailer['version'], FORMAT_VERSION))
+        self.header = trailer['header']
+        self.label_column = trailer['label_column']
+        self.features = [name for i, name in enumerate(self.header) if i != self.label_column]
+        self.settings = trailer['settings']
+        self.chunks = trailer['chunks']
+        self.sha256 = trailer['sha256']
+        shape = tuple(trailer['shape'])
+        self.matrix = _memmap(file_path, trailer['dtype'], trailer['data_offset'], shape)
+        self.permutation = _memmap(file_path, '<i8', trailer['permutation_offset'], shape[:1])
+        if verify:
+            self.verify()
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def verify(self):
+        """
+        Hashes the rows and raises ValueError if they do not match the
+        checksum written with them.
+        """
+        h = hashlib.sha256()
+        data = self.matrix.reshape(-1).view(np.uint8)
+        for start in range(0, len(data), VERIFY_BLOCK):
+            h.update(data[start:start + VERIFY_BLOCK])
+        if h.hexdigest() != self.sha256:
+            raise ValueError('%s: checksum mismatch, the rows are corrupt' % self.file_path)
+
+    def columns(self, names):
+        """
+        Returns the indices of the columns called names.
+        """
+        index = {name: i for i, name in enumerate(self.header)}
+        missing = [name for name in names if name not in index]
+        if missing:
+            raise KeyError('unknown columns: %s' % ', '.join(missing))
+        return [index[name] for name in names]
+
+    def labels(self):
+        """
+        Returns the label of every row.
+        """
+        if self.label_column is None:
+            raise ValueError('%s has no label column' % self.file_path)
+        return np.asarray(self.matrix[:, self.label_column])
+
+    def select(self, features=None, labels=None):
+        """
+        Returns the rows whose label is one of labels (all rows if None),
+        restricted to the columns named in features (all but the label if
+        None). Only the selected rows are read. A selection of consecutive
+        columns over all the rows is a view of the memory map.
+        """
+        columns = self.columns(self.features if features is None else features)
+        if len(columns) and np.all(np.diff(columns) == 1):
+            columns = slice(columns[0], columns[-1] + 1)
+        if labels is None:
+            return self.matrix[:, columns]
+        rows = np.flatnonzero(np.isin(self.labels(), labels))
+        return self.matrix[rows][:, columns] if isinstance(columns, slice) \
+            else self.matrix[np.ix_(rows, columns)]
+
+
+def _memmap(file_path, dtype, offset, shape):
+    # np.memmap cannot map zero bytes
+    if not np.prod(shape):
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(file_path, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Describes a training matrix store.')
+    parser.add_argument('file_path')
+    parser.add_argument('--verify', action='store_true', help='check the checksum of the rows')
+    args = parser.parse_args()
+
+    store = MatrixStore(args.file_path, verify=args.verify)
+    print('%s: %d rows x %d columns of %s, %d sources' % (
+        args.file_path, store.matrix.shape[0], store.matrix.shape[1], store.matrix.dtype,
+        len(store.chunks)))
+    if store.label_column is not None:
+        values, counts = np.unique(store.labels(), return_counts=True)
+        print('labels:', ', '.join('%g: %d' % vc for vc in zip(values, counts)))
+    print('settings:', json.dumps(store.settings, sort_keys=True))
+    if args.verify:
+        print('checksum OK')
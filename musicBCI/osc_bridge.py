@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+###  Live OSC bridge to SuperCollider.
+
+Instead of writing sc-input.txt and replaying it on a fixed clock, the
+parameters of every encoded window are sent over UDP as soon as they are
+known. Each event is an OSC bundle time-tagged "latency" seconds ahead, so
+network and encoding jitter are absorbed by the receiver's scheduler:
+
+    bridge = OSCBridge(port=57120)      # osc_receiver.scd running in sclang
+    bridge.send_latent(encoder.predict(image), label, timestamp=window_start)
+
+With target='scsynth', /s_new messages for the \\event SynthDef go straight
+to the server (default port 57110) and are started sample-accurately.
+
+Run as a script to replay a parameter file written by sc_export.py, or to
+turn it into a score for non-real-time rendering:
+    python osc_bridge.py ../sc-input.txt [--port 57120] [--interval 0.2]
+    python osc_bridge.py ../sc-input.txt --nrt score.osc
+"""
+import time
+import socket
+import struct
+import argparse
+import numpy as np
+from sc_export import calc_params, read_sc_params
+from timing import stage
+
+SCLANG_PORT = 57120
+SCSYNTH_PORT = 57110
+EVENT_ADDRESS = '/bci/event'
+
+# Seconds between the NTP epoch (1900) and the Unix epoch (1970)
+NTP_EPOCH_OFFSET = 2208988800
+IMMEDIATELY = 1
+
+# Length (s) of the \event envelope, rendered after the last event of a score
+EVENT_DURATION = 0.31
+
+
+def _osc_string(s):
+    b = s.encode('ascii') + b'\0'
+    return b + b'\0' * (-len(b) % 4)
+
+
+def osc_message(address, *args):
+    """
+    Encodes an OSC message. ints are sent as int32, floats as float32 and
+    strings as OSC strings.
+    """
+    tags = ','
+    data = []
+    for arg in args:
+        if isinstance(arg, (bool, np.bool_)):
+            raise TypeError('unsupported OSC argument: %r' % arg)
+        if isinstance(arg, (int, np.integer)):
+            tags += 'i'
+            data.append(struct.pack('>i', arg))
+        elif isinstance(arg, (float, np.floating)):
+            tags += 'f'
+            data.append(struct.pack('>f', arg))
+        elif isinstance(arg, str):
+            tags += 's'
+            data.append(_osc_string(arg))
+        else:
+            raise TypeError('unsupported OSC argument: %r' % arg)
+    return _osc_string(address) + _osc_string(tags) + b''.join(data)
+
+
+def osc_timetag(unix_time):
+    """
+    Returns the 64-bit NTP time tag of a Unix time (None for "immediately").
+    """
+    if unix_time is None:
+        return IMMEDIATELY
+    seconds = unix_time + NTP_EPOCH_OFFSET
+    whole = int(seconds)
+    return (whole << 32) | int((seconds - whole) * (1 << 32))
+
+
+def osc_bundle(unix_time, *messages):
+    """
+    Encodes an OSC bundle of already encoded messages, to be executed at
+    unix_time.
+    """
+    parts = [b'#bundle\0', struct.pack('>Q', osc_timetag(unix_time))]
+    for m in messages:
+        parts.append(struct.pack('>i', len(m)))
+        parts.append(m)
+    return b''.join(parts)
+
+
+def decode_packet(packet):
+    """
+    Decodes an OSC message or bundle into a list of (unix_time, address, args),
+    unix_time being None for messages outside a bundle or time-tagged
+    "immediately". Used to check what the bridge sends.
+    """
+    def read_string(data, pos):
+        end = data.index(b'\0', pos)
+        return data[pos:end].decode('ascii'), (end + 4) & ~3
+
+    if packet.startswith(b'#bundle\0'):
+        tag, = struct.unpack_from('>Q', packet, 8)
+        unix_time = None if tag == IMMEDIATELY else (tag / float(1 << 32)) - NTP_EPOCH_OFFSET
+        ret, pos = [], 16
+        while pos < len(packet):
+            size, = struct.unpack_from('>i', packet, pos)
+            for _, address, args in decode_packet(packet[pos + 4:pos + 4 + size]):
+                ret.append((unix_time, address, args))
+            pos += 4 + size
+        return ret
+
+    address, pos = read_string(packet, 0)
+    tags, pos = read_string(packet, pos)
+    args = []
+    for t in tags[1:]:
+        if t == 'i':
+            args.append(struct.unpack_from('>i', packet, pos)[0])
+            pos += 4
+        elif t == 'f':
+            args.append(struct.unpack_from('>f', packet, pos)[0])
+            pos += 4
+        elif t == 's':
+            s, pos = read_string(packet, pos)
+            args.append(s)
+        else:
+            raise ValueError('unsupported OSC type tag: %r' % t)
+    return [(None, address, args)]
+
+
+def nrt_score(freq, amp, interval=0.2, synthdef_path=None, tail=EVENT_DURATION):
+    """
+    Builds a non-real-time score for scsynth: one /s_new command of the \\event
+    SynthDef per event, spaced by interval seconds. Render it with
+        scsynth -N score.osc _ out.wav 44100 WAV int16 -o 2
+
+    Parameters:
+        freq (numpy.ndarray): frequencies of the events
+        amp (numpy.ndarray): amplitude multipliers of the events
+        interval (float): seconds between events
+        synthdef_path (str): .scsyndef file loaded at time 0. Not needed if
+            the SynthDef was stored in the default synthdefs directory.
+        tail (float): seconds rendered after the last event
+
+    Returns:
+        bytes: the score, as size-prefixed OSC bundles
+    """
+    freq = np.asarray(freq, dtype=np.float64).ravel()
+    amp = np.asarray(amp, dtype=np.float64).ravel()
+    if len(freq) != len(amp):
+        raise ValueError('%d frequencies for %d amplitudes' % (len(freq), len(amp)))
+
+    def packet(t, *messages):
+        b = osc_bundle(None, *messages)
+        return struct.pack('>i', len(b)) + b[:8] + struct.pack('>Q', int(round(t * (1 << 32)))) + b[16:]
+
+    # Every event has the same layout, only the time tag and the last two
+    # arguments change: the events are filled in at once in a structured
+    # array over a template packet
+    template = packet(0., osc_message('/s_new', 'event', -1, 0, 0, 'freq', 0., 'amp', 0.))
+    record = np.dtype([('head', 'V12'), ('tag', '>u8'), ('body', 'V%d' % (len(template) - 32)),
+                       ('freq', '>f4'), ('amp_name', 'V4'), ('amp', '>f4')])
+    events = np.repeat(np.frombuffer(template, dtype=record), len(freq))
+    times = np.arange(len(freq)) * interval
+    events['tag'] = np.round(times * (1 << 32)).astype(np.uint64)
+    events['freq'] = freq
+    events['amp'] = amp
+
+    head = packet(0., osc_message('/d_load', synthdef_path)) if synthdef_path else b''
+    end = times[-1] + tail if len(times) else tail
+    # A last command at the end time sets the length of the rendering
+    return head + events.tobytes() + packet(end, osc_message('/c_set', 0, 0))
+
+
+def write_nrt_score(file_path, freq, amp, interval=0.2, synthdef_path=None, tail=EVENT_DURATION):
+    """
+    Writes the score built by nrt_score to a file, in a single write.
+    """
+    with open(file_path, 'wb') as f:
+        f.write(nrt_score(freq, amp, interval, synthdef_path, tail))
+
+
+class OSCBridge:
+    """
+    Sends (freq, amp, label) events to SuperCollider over UDP.
+
+    Parameters:
+        host (str): address of the machine running SuperCollider
+        port (int): UDP port. Defaults to sclang's (57120), or scsynth's
+            (57110) if target is 'scsynth'.
+        target (str): 'sclang' sends EVENT_ADDRESS messages to
+            osc_receiver.scd; 'scsynth' sends /s_new messages for the \\event
+            SynthDef directly to the server
+        latency (float): how far ahead (s) the bundles are time-tagged. It
+            must cover the encoding and network jitter.
+        address (str): OSC address of the events sent to sclang
+    """
+
+    def __init__(self, host='127.0.0.1', port=None, target='sclang', latency=0.2,
+                 address=EVENT_ADDRESS):
+        if target not in ('sclang', 'scsynth'):
+            raise ValueError('unknown target %r' % target)
+        if port is None:
+            port = SCLANG_PORT if target == 'sclang' else SCSYNTH_PORT
+        self.destination = (host, port)
+        self.target = target
+        self.latency = latency
+        self.address = address
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Offset from the timestamps of the events to the Unix clock, set by
+        # the first timestamped event
+        self._clock_offset = None
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def reset_clock(self):
+        """
+        Forgets the mapping of event timestamps to wall-clock time, e.g. when
+        the acquisition restarts.
+        """
+        self._clock_offset = None
+
+    def _event_time(self, timestamp):
+        now = time.time()
+        if timestamp is None:
+            return now + self.latency
+        # Events keep the spacing of their timestamps, whatever the delay at
+        # which they were computed
+        if self._clock_offset is None:
+            self._clock_offset = now + self.latency - timestamp
+        return timestamp + self._clock_offset
+
+    def _message(self, freq, amp, label):
+        if self.target == 'scsynth':
+            return osc_message('/s_new', 'event', -1, 0, 1,
+                               'freq', float(freq), 'amp', float(amp))
+        return osc_message(self.address, float(freq), float(amp), int(label))
+
+    def send(self, freq, amp, label, timestamp=None):
+        """
+        Sends one event.
+
+        Parameters:
+            freq (float): frequency (Hz)
+            amp (float): amplitude multiplier
+            label (int): mental state of the window
+            timestamp (float): time of the window (s, any clock). The first
+                timestamped event is played "latency" seconds from now, and
+                the later ones keep the same spacing as their timestamps. If
+                None, the event is played "latency" seconds from now.
+
+        Returns:
+            float: Unix time the event is scheduled at
+        """
+        with stage('emit'):
+            at = self._event_time(timestamp)
+            self.sock.sendto(osc_bundle(at, self._message(freq, amp, label)), self.destination)
+        return at
+
+    def send_latent(self, vec, label, timestamp=None):
+        """
+        Maps the encoder output of one window ([z_mean, z_log_var, z]) to its
+        parameters with sc_export.calc_params and sends it.
+        """
+        freq, mul = calc_params(vec)
+        return self.send(freq[0], mul[0], label, timestamp)
+
+    def send_params(self, freq, amp, labels, interval=0.2):
+        """
+        Sends a sequence of events spaced by interval seconds, e.g. the
+        contents of a parameter file. Every event is sent "latency" seconds
+        before it has to be played.
+        """
+        self.reset_clock()
+        start = time.time()
+        for i, event in enumerate(zip(freq, amp, labels)):
+            due = start + i * interval
+            time.sleep(max(0., due - time.time()))
+            self.send(*event, timestamp=due)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Plays a parameter file through SuperCollider over OSC.')
+    parser.add_argument('params_file', help='text or binary file written by sc_export.py, e.g. sc-input.txt')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=None)
+    parser.add_argument('--target', choices=('sclang', 'scsynth'), default='sclang')
+    parser.add_argument('--interval', type=float, default=0.2, help='seconds between events')
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--nrt', metavar='SCORE_FILE', help='write a non-real-time score instead of playing')
+    args = parser.parse_args()
+
+    freq, amp, labels = read_sc_params(args.params_file)
+    if args.nrt:
+        write_nrt_score(args.nrt, freq, amp, args.interval)
+    else:
+        with OSCBridge(args.host, args.port, args.target, args.latency) as bridge:
+            bridge.send_params(freq, amp, labels, interval=args.interval)
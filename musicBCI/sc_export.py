@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+###  Export of the VAE latent space as SuperCollider parameters.
+
+Every 12x12 feature image is passed through the trained encoder, and its
+latent vectors are mapped to a frequency and an amplitude multiplier that
+sound_generator.scd reads from sc-input.txt, three lines per time slice:
+
+    freq
+    mul
+    label
+
+Usable from the notebook after training, or as a library call:
+
+    from sc_export import write_sc_params_to_file
+    write_sc_params_to_file(matrix, labels, encoder)
+
+The same parameters can be written as a compact binary file
+(file_format='binary'), or as a non-real-time score of /s_new commands that
+scsynth renders to audio in one step (file_format='nrt', see
+osc_bridge.nrt_score).
+"""
+import numpy as np
+from timing import stage
+
+SC_INPUT = 'sc-input.txt'
+
+# Binary parameter file: magic, number of events, then one packed record per
+# event
+PARAMS_MAGIC = b'SCP1'
+PARAMS_RECORD = np.dtype([('freq', '<u2'), ('mul', '<f4'), ('label', 'u1')])
+
+
+def encode(matrix, encoder, batch_size=256):
+    """
+    Runs the encoder over a whole matrix of images in batches.
+
+    Parameters:
+        matrix (numpy.ndarray): [N x 12 x 12] or [N x 12 x 12 x 1] images
+        encoder (keras.Model): encoder returning [z_mean, z_log_var, z]
+        batch_size (int): number of images per forward pass
+
+    Returns:
+        list: the encoder outputs, each a [N x latent_dim] array
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 3:
+        matrix = matrix[..., np.newaxis]
+    with stage('export.encode'):
+        return [np.asarray(v) for v in encoder.predict(matrix, batch_size=batch_size, verbose=0)]
+
+
+def calc_params(vec):
+    """
+    Maps latent vectors to SuperCollider parameters.
+
+    The first latent dimension of z_mean, z_log_var and z gives the frequency:
+    the position of their mean between their minimum and maximum, scaled to
+    0-800. The second dimension gives the amplitude multiplier, scaled to 0-4.
+
+    Parameters:
+        vec (list): [z_mean, z_log_var, z], each a [N x 2] array (or a single
+            latent vector of shape [2])
+
+    Returns:
+        numpy.ndarray: frequencies (int), rounded to the unit
+        numpy.ndarray: multipliers, rounded to one decimal
+    """
+    # [N x 2 x 3]: one row per latent dimension, holding z_mean, z_log_var, z
+    vec = np.stack([np.atleast_2d(v) for v in vec], axis=-1)
+    vmin = vec.min(axis=-1)
+    vmax = vec.max(axis=-1)
+    scaled = (vec.mean(axis=-1) - vmin) / (vmax - vmin)
+
+    # Normalise frequency to range 0-800
+    freq = np.round(scaled[:, 0] * 800).astype(int)
+    # Normalise mul to range 0-4
+    mul = np.round(scaled[:, 1] * 4, 1)
+    return freq, mul
+
+
+def write_sc_params_binary(file_path, freq, mul, labels):
+    """
+    Writes parameters to a binary file: PARAMS_MAGIC, the number of events
+    (uint32) and a PARAMS_RECORD per event, 7 bytes each.
+    """
+    records = np.empty(len(freq), dtype=PARAMS_RECORD)
+    records['freq'] = freq
+    records['mul'] = mul
+    records['label'] = labels
+    with open(file_path, 'wb') as f:
+        f.write(PARAMS_MAGIC + np.uint32(len(records)).tobytes() + records.tobytes())
+
+
+def read_sc_params(file_path):
+    """
+    Reads a parameter file written by write_sc_params_to_file, in the text
+    or in the binary format.
+
+    Returns:
+        numpy.ndarray: frequencies
+        numpy.ndarray: multipliers
+        numpy.ndarray: labels
+    """
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    if data.startswith(PARAMS_MAGIC):
+        count = int(np.frombuffer(data, dtype='<u4', count=1, offset=len(PARAMS_MAGIC))[0])
+        records = np.frombuffer(data, dtype=PARAMS_RECORD, count=count,
+                                offset=len(PARAMS_MAGIC) + 4)
+        return (records['freq'].astype(int), np.round(records['mul'].astype(np.float64), 1),
+                records['label'].astype(int))
+    values = np.array(data.split(), dtype=np.float64)
+    values = values[:len(values) // 3 * 3].reshape(-1, 3)
+    return values[:, 0].astype(int), values[:, 1], values[:, 2].astype(int)
+
+
+def write_sc_params_to_file(matrix, labels, encoder, file_path=SC_INPUT, batch_size=256,
+                            file_format='text', interval=0.2):
+    """
+    Encodes every time slice of matrix and writes its parameters to the file
+    read by sound_generator.scd.
+
+    Parameters:
+        matrix (numpy.ndarray): [N x 12 x 12] or [N x 12 x 12 x 1] images
+        labels (numpy.ndarray): N labels of the time slices
+        encoder (keras.Model): encoder returning [z_mean, z_log_var, z]
+        file_path (str): output file
+        batch_size (int): number of images per encoder pass
+        file_format (str): 'text' (three lines per time slice), 'binary'
+            (see write_sc_params_binary) or 'nrt' (non-real-time OSC score)
+        interval (float): seconds between events in the 'nrt' score
+
+    Returns:
+        numpy.ndarray: frequencies written
+        numpy.ndarray: multipliers written
+    """
+    freq, mul = calc_params(encode(matrix, encoder, batch_size))
+    labels = np.asarray(labels).astype(int).ravel()
+    if len(labels) != len(freq):
+        raise ValueError('%d labels for %d time slices' % (len(labels), len(freq)))
+
+    if file_format == 'binary':
+        write_sc_params_binary(file_path, freq, mul, labels)
+    elif file_format == 'nrt':
+        from osc_bridge import write_nrt_score
+        write_nrt_score(file_path, freq, mul, interval)
+    elif file_format == 'text':
+        lines = ('%d\n%s\n%d\n' % row for row in zip(freq, mul, labels))
+        with open(file_path, 'w') as f:
+            f.write(''.join(lines))
+    else:
+        raise ValueError('unknown file format %r' % file_format)
+    return freq, mul
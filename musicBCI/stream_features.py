@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+###  Streaming feature extraction for live sessions.
+
+The offline path (generate_feature_vectors_from_samples) reads a whole CSV
+file. StreamFeatureExtractor produces the same lag-1 feature vectors from
+sample blocks pushed as they arrive, e.g. from BrainFlow:
+
+    extractor = StreamFeatureExtractor(nsignals=len(eeg_channels), sampling_rate=250)
+    while streaming:
+        data = board.get_board_data()
+        for vector in extractor.push(data[timestamp_channel], data[eeg_channels].T):
+            ...
+
+Samples are written into a fixed-size ring buffer, and a feature vector is
+emitted every time a window of "period" seconds completes, i.e. every half
+period. The features of a window are computed once: the lag-1 half of the next
+vector is the current half of the previous one.
+"""
+import numpy as np
+from eeg_feature_generation import (generate_feature_vector, feature_names,
+                                    resample_windows, DEFAULT_FEATURES)
+from timing import stage
+
+
+class StreamFeatureExtractor:
+    """
+    Stateful feature extractor over a ring buffer of samples.
+
+    Parameters:
+        nsignals (int): number of signals in each pushed block
+        sampling_rate (float): nominal sampling rate (Hz), used to size the
+            ring buffer
+        nsamples (int): number of samples each window is resampled to
+        period (float): width of the time windows, in seconds
+        state (str/int/float): label appended to the vectors, or None
+        max_gap (float): largest step between timestamps (in seconds) allowed
+            within a window. Defaults to period / 10.
+        capacity (int): number of samples kept in the ring buffer. Defaults to
+            four periods at sampling_rate.
+        wavelet_level (int): number of DWT levels of the wavelet features
+        features (tuple): names of the features to calculate (see FEATURES in
+            eeg_feature_generation)
+        resampling (str): 'fft' or 'polyphase' (see resample_windows)
+        dtype (numpy.dtype): floating point type of the resampled windows and
+            of the vectors (see generate_feature_vectors_from_samples). The
+            ring buffer keeps float64 timestamps.
+    """
+
+    def __init__(self, nsignals, sampling_rate=250., nsamples=150, period=1.,
+                 state=None, max_gap=None, capacity=None, wavelet_level=1,
+                 features=DEFAULT_FEATURES, resampling='fft',
+                 dtype=np.float64):
+        self.nsignals = nsignals
+        self.nsamples = nsamples
+        self.period = period
+        self.hop = 0.5 * period
+        self.state = state
+        self.wavelet_level = wavelet_level
+        self.features = tuple(features)
+        self.resampling = resampling
+        self.dtype = dtype
+        self.max_gap = 0.1 * period if max_gap is None else max_gap
+        self.capacity = capacity or int(np.ceil(4 * period * sampling_rate))
+
+        headers = feature_names(nsignals, state, wavelet_level, self.features)
+        self.nlag = len(headers) - 1 if state is not None else len(headers)
+        self.names = ['lag1_' + s for s in headers[:-1]] + headers
+
+        # Every sample is written twice, at i and i + capacity, so that the
+        # last "capacity" samples are always a contiguous view
+        self._buffer = np.empty((2 * self.capacity, nsignals + 1))
+        self._row = np.empty(self.nlag + len(headers), dtype=dtype)
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets every pushed sample, e.g. when the board restarts streaming.
+        """
+        self._count = 0
+        self._t0 = None
+        self._offset = 0.
+        self._has_previous = False
+
+    def _retained(self):
+        # Absolute index of the oldest sample in the buffer, and a view of all
+        # the retained samples in order
+        first = max(0, self._count - self.capacity)
+        start = first % self.capacity
+        return first, self._buffer[start:start + self._count - first]
+
+    def _write(self, timestamps, samples):
+        n = len(timestamps)
+        pos = self._count % self.capacity
+        head = min(n, self.capacity - pos)
+        for offset in (0, self.capacity):
+            self._buffer[offset + pos:offset + pos + head, 0] = timestamps[:head]
+            self._buffer[offset + pos:offset + pos + head, 1:] = samples[:head]
+            self._buffer[offset:offset + n - head, 0] = timestamps[head:]
+            self._buffer[offset:offset + n - head, 1:] = samples[head:]
+        self._count += n
+
+    def _emit_ready(self, vectors):
+        first, retained = self._retained()
+        timestamps = retained[:, 0]
+        while True:
+            rstart = self._t0 + self._offset
+            # The window is only complete once a later sample has arrived
+            if timestamps[-1] <= rstart + self.period:
+                return
+            index_0 = np.searchsorted(timestamps, rstart, side='right') - 1
+            index_1 = np.searchsorted(timestamps, rstart + self.period, side='right') - 1
+            if index_0 < 0:
+                raise ValueError('ring buffer too small for the stream: raise capacity')
+            self._offset += self.hop
+
+            s = retained[index_0:index_1]
+            duration = timestamps[index_1] - timestamps[index_0]
+            if (index_1 <= index_0 or duration < 0.9 * self.period
+                    or np.any(np.diff(timestamps[index_0:index_1 + 1]) > self.max_gap)):
+                # Skipped window: the next one has no previous window to pair with
+                self._has_previous = False
+                continue
+
+            with stage('stream.window'):
+                ry = resample_windows(retained, [index_0], [index_1], self.nsamples,
+                                      self.resampling, self.dtype)
+                r, _ = generate_feature_vector(ry[0], self.state, s[:, 0],
+                                               self.wavelet_level, self.features)
+
+            if self._has_previous:
+                # The previous window's features are the current half of the
+                # last row; move them to the lag half instead of recomputing
+                self._row[:self.nlag] = self._row[self.nlag:2 * self.nlag]
+                self._row[self.nlag:] = r
+                vectors.append(self._row.copy())
+            else:
+                self._row[self.nlag:] = r
+            self._has_previous = True
+
+    def push(self, timestamps, samples):
+        """
+        Appends a block of samples and returns the feature vectors of the
+        windows it completes (possibly none).
+
+        Parameters:
+            timestamps (numpy.ndarray): 1D array of increasing timestamps (s)
+            samples (numpy.ndarray): 2D [nblock x nsignals] array of values
+
+        Returns:
+            list: 1D feature vectors laid out as self.names, oldest first
+        """
+        timestamps = np.asarray(timestamps, dtype=float)
+        samples = np.asarray(samples, dtype=float).reshape(len(timestamps), self.nsignals)
+        if self._t0 is None and len(timestamps):
+            self._t0 = timestamps[0]
+
+        # Large blocks are written in pieces so that no window slides out of
+        # the buffer before it is processed
+        vectors = []
+        step = max(1, self.capacity // 2)
+        for i in range(0, len(timestamps), step):
+            with stage('acquire'):
+                self._write(timestamps[i:i + step], samples[i:i + step])
+            self._emit_ready(vectors)
+        return vectors
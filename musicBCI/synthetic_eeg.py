@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+###  Deterministic synthetic EEG for load and scale testing.
+
+Recordings are built from seeded random streams: brown-ish background
+noise, band-limited alpha (8-12 Hz) and beta (13-30 Hz) components whose
+amplitudes depend on the mental state, eye blinks on the frontal channels,
+dropouts (runs of missing samples) and timestamp jitter. Signals are
+generated and written in chunks, with the filter states carried over, so
+hours of data take little memory. A recording only depends on its seed and
+settings.
+
+Two layouts are written:
+    dataset CSV     timestamps, channels..., Label   (matrix_from_csv_file)
+    OpenBCI .txt    OpenBCI GUI raw EEG data file
+
+and corpora follow the name-state-n.csv naming that gen_training_matrix
+expects:
+    python synthetic_eeg.py OUT_DIR --subjects 40 --sessions 3 --duration 60
+"""
+import os
+import time
+import argparse
+import numpy as np
+import scipy.signal
+
+STATES = ('relaxed', 'neutral', 'concentrating')
+
+# Label written for each state, as in gen_train_matrix.state_from_file_name
+STATE_LABELS = {'relaxed': 0., 'neutral': 1., 'concentrating': 2.}
+
+# RMS amplitude (uV) of the alpha and beta components in each state
+STATE_PROFILES = {'relaxed': (12., 3.), 'neutral': (7., 6.), 'concentrating': (3., 10.)}
+
+# Channel names of the 4-channel (Muse) recordings of the dataset
+DATASET_CHANNELS = ('TP9', 'AF7', 'AF8', 'TP10')
+
+# Seconds of signal generated at a time
+CHUNK_SECONDS = 60.
+
+
+class SyntheticEEG:
+    """
+    Seeded generator of a synthetic multichannel EEG recording.
+
+    Parameters:
+        nsignals (int): number of channels
+        sampling_rate (float): nominal sampling rate (Hz)
+        state (str): mental state ('relaxed', 'neutral' or 'concentrating'),
+            which sets the alpha and beta amplitudes
+        seed (int/tuple): seed of every random stream of the recording
+        blink_rate (float): mean number of blinks per second
+        dropout_rate (float): mean number of dropouts per second
+        dropout_length (tuple): range of the dropout durations (s)
+        jitter (float): standard deviation of the timestamp jitter (s),
+            clipped to a quarter of the sampling period
+        start_time (float): timestamp of the first sample (s)
+    """
+
+    def __init__(self, nsignals=4, sampling_rate=256., state='neutral', seed=0,
+                 blink_rate=0.2, dropout_rate=1 / 120., dropout_length=(0.05, 0.5),
+                 jitter=0.0005, start_time=0.):
+        if state not in STATE_PROFILES:
+            raise ValueError('unknown state %r, expected one of %s' % (state, STATES))
+        self.nsignals = nsignals
+        self.sampling_rate = sampling_rate
+        self.state = state
+        self.blink_rate = blink_rate
+        self.dropout_rate = dropout_rate
+        self.dropout_length = dropout_length
+        self.jitter = jitter
+        self.start_time = start_time
+        self.rng = np.random.default_rng(seed)
+
+        nyquist = sampling_rate / 2.
+        self._alpha = scipy.signal.butter(2, [8 / nyquist, 12 / nyquist], 'bandpass', output='sos')
+        self._beta = scipy.signal.butter(2, [13 / nyquist, 30 / nyquist], 'bandpass', output='sos')
+        # Gains that turn unit white noise into components of the state's RMS
+        alpha_rms, beta_rms = STATE_PROFILES[state]
+        self._alpha_gain = alpha_rms / np.sqrt(4 / nyquist)
+        self._beta_gain = beta_rms / np.sqrt(17 / nyquist)
+        self._alpha_zi = np.zeros((self._alpha.shape[0], 2, nsignals))
+        self._beta_zi = np.zeros((self._beta.shape[0], 2, nsignals))
+        self._brown_zi = np.zeros((1, nsignals))
+        # Blinks show mostly on the frontal channels (AF7/AF8 in the dataset)
+        self._blink_weights = np.full(nsignals, 0.15)
+        self._blink_weights[1:3] = 1.
+        self._next = 0
+
+    def chunk(self, nsamples):
+        """
+        Generates the next nsamples samples of the recording.
+
+        Returns:
+            numpy.ndarray: 1D array of increasing timestamps (s); samples that
+                fall in a dropout are missing
+            numpy.ndarray: 2D [nkept x nsignals] array of values (uV)
+        """
+        rng = self.rng
+        white = rng.standard_normal((3, nsamples, self.nsignals))
+        alpha, self._alpha_zi = scipy.signal.sosfilt(self._alpha, white[0], axis=0,
+                                                     zi=self._alpha_zi)
+        beta, self._beta_zi = scipy.signal.sosfilt(self._beta, white[1], axis=0,
+                                                   zi=self._beta_zi)
+        brown, self._brown_zi = scipy.signal.lfilter([1.], [1., -0.995], white[2], axis=0,
+                                                     zi=self._brown_zi)
+        signals = self._alpha_gain * alpha + self._beta_gain * beta + 2. * brown
+
+        # Blinks: ~250 ms bumps of 50-150 uV starting at Poisson times
+        width = int(0.25 * self.sampling_rate)
+        shape = np.hanning(width)
+        nblinks = rng.poisson(self.blink_rate * nsamples / self.sampling_rate)
+        blink = np.outer(shape, self._blink_weights)
+        for start, amp in zip(rng.integers(0, max(1, nsamples - width), nblinks),
+                              rng.uniform(50., 150., nblinks)):
+            signals[start:start + width] += amp * blink[:nsamples - start]
+
+        index = self._next + np.arange(nsamples)
+        # Jitter is clipped to a quarter of the sampling period, so that the
+        # samples stay in order, even with timestamps rounded to the ms
+        bound = 0.25 / self.sampling_rate
+        jitter = np.clip(self.jitter * rng.standard_normal(nsamples), -bound, bound)
+        timestamps = self.start_time + index / self.sampling_rate + jitter
+        self._next += nsamples
+
+        keep = np.ones(nsamples, dtype=bool)
+        ndropouts = rng.poisson(self.dropout_rate * nsamples / self.sampling_rate)
+        lengths = (rng.uniform(*self.dropout_length, ndropouts) * self.sampling_rate).astype(int)
+        for start, length in zip(rng.integers(0, nsamples, ndropouts), lengths):
+            keep[start:start + length] = False
+        return timestamps[keep], signals[keep]
+
+    def chunks(self, duration, chunk_seconds=CHUNK_SECONDS):
+        """
+        Yields (timestamps, signals) chunks covering duration seconds.
+        """
+        total = int(round(duration * self.sampling_rate))
+        step = int(chunk_seconds * self.sampling_rate)
+        for start in range(0, total, step):
+            yield self.chunk(min(step, total - start))
+
+
+def _format_rows(row_format, columns):
+    # One %-format over the whole block is several times faster than savetxt
+    matrix = np.column_stack(columns)
+    return (row_format * len(matrix)) % tuple(matrix.ravel())
+
+
+def write_dataset_csv(file_path, generator, duration, label=None):
+    """
+    Writes a recording in the dataset CSV layout: a header row, then the
+    timestamp (s, millisecond precision), the channels and the label of every
+    sample. The label column is ignored by matrix_from_csv_file, as the
+    auxiliary channel of the original files.
+    """
+    nsignals = generator.nsignals
+    channels = DATASET_CHANNELS if nsignals == len(DATASET_CHANNELS) else \
+        ['ch%d' % i for i in range(nsignals)]
+    if label is None:
+        label = STATE_LABELS[generator.state]
+    row_format = '%.3f' + ',%.2f' * nsignals + ',%g\n'
+    with open(file_path, 'w') as f:
+        f.write(','.join(['timestamps'] + list(channels) + ['Label']) + '\n')
+        for timestamps, signals in generator.chunks(duration):
+            f.write(_format_rows(row_format, [timestamps, signals, np.full(len(timestamps), label)]))
+
+
+def write_openbci_txt(file_path, generator, duration, epoch=1.6e9):
+    """
+    Writes a recording as an OpenBCI GUI raw EEG data file: '%' header lines,
+    then per sample the sample index (0-255), the channels, three
+    accelerometer values, ten unused values, the Unix timestamp (ms) and the
+    formatted time of day.
+
+    Parameters:
+        epoch (float): Unix time (s) of timestamp 0 of the generator
+    """
+    nsignals = generator.nsignals
+    row_format = ('%d' + ', %.2f' * nsignals + ', %.3f, %.3f, %.3f' + ',0.0' * 10
+                  + ', %d, %02d:%02d:%06.3f\n')
+    with open(file_path, 'w') as f:
+        f.write('%%OpenBCI Raw EEG Data\n%%Number of channels = %d\n'
+                '%%Sample Rate = %g Hz\n%%Board = OpenBCI_GUI$BoardCytonSerial\n'
+                % (nsignals, generator.sampling_rate))
+        count = 0
+        for timestamps, signals in generator.chunks(duration):
+            n = len(timestamps)
+            unix_ms = np.round((epoch + timestamps) * 1000.)
+            seconds_of_day = (unix_ms / 1000.) % 86400.
+            accel = np.zeros((n, 3))
+            f.write(_format_rows(row_format, [
+                (count + np.arange(n)) % 256, signals, accel, unix_ms,
+                seconds_of_day // 3600, (seconds_of_day // 60) % 60, seconds_of_day % 60]))
+            count += n
+
+
+def write_corpus(directory, nsubjects=4, nsessions=1, duration=60., nsignals=4,
+                 sampling_rate=256., seed=0, formats=('csv',), **kwargs):
+    """
+    Writes a corpus of recordings named name-state-n.csv (and/or .txt), one
+    per subject, state and session, e.g. subjecta-relaxed-1.csv.
+
+    Every recording has its own seed derived from (seed, subject, state,
+    session), so a corpus is reproducible and any file of it can be
+    regenerated on its own. Extra keyword arguments go to SyntheticEEG.
+
+    Returns:
+        list: paths of the files written
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for subject in range(nsubjects):
+        name = 'subject' + _subject_suffix(subject)
+        for state_index, state in enumerate(STATES):
+            for session in range(1, nsessions + 1):
+                for fmt in formats:
+                    generator = SyntheticEEG(nsignals, sampling_rate, state,
+                                             (seed, subject, state_index, session), **kwargs)
+                    path = os.path.join(directory, '%s-%s-%d.%s' % (name, state, session, fmt))
+                    if fmt == 'csv':
+                        write_dataset_csv(path, generator, duration)
+                    elif fmt == 'txt':
+                        write_openbci_txt(path, generator, duration)
+                    else:
+                        raise ValueError("unknown format %r, expected 'csv' or 'txt'" % fmt)
+                    paths.append(path)
+    return paths
+
+
+def _subject_suffix(i):
+    # a, b, ..., z, ba, bb, ... (letters only, since '-' separates the fields)
+    suffix = ''
+    while True:
+        suffix = chr(ord('a') + i % 26) + suffix
+        i //= 26
+        if not i:
+            return suffix
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Writes a corpus of synthetic EEG recordings.')
+    parser.add_argument('directory')
+    parser.add_argument('--subjects', type=int, default=4)
+    parser.add_argument('--sessions', type=int, default=1, help='recordings per subject and state')
+    parser.add_argument('--duration', type=float, default=60., help='seconds per recording')
+    parser.add_argument('--channels', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=256., help='sampling rate (Hz)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--formats', nargs='+', choices=('csv', 'txt'), default=['csv'])
+    parser.add_argument('--jitter', type=float, default=0.0005, help='timestamp jitter (s)')
+    parser.add_argument('--blink-rate', type=float, default=0.2, help='blinks per second')
+    parser.add_argument('--dropout-rate', type=float, default=1 / 120., help='dropouts per second')
+    args = parser.parse_args()
+
+    start = time.time()
+    paths = write_corpus(args.directory, args.subjects, args.sessions, args.duration,
+                         args.channels, args.rate, args.seed, args.formats,
+                         jitter=args.jitter, blink_rate=args.blink_rate,
+                         dropout_rate=args.dropout_rate)
+    print('Wrote %d files in %.1f s' % (len(paths), time.time() - start))
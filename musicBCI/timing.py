@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+###  Latency instrumentation of the acquisition -> features -> encode -> sound
+###  pipeline.
+
+Every stage of the pipeline is timed into a fixed-size histogram, so the
+overhead per measurement is a couple of perf_counter calls and a counter
+increment whatever the session length:
+
+    from timing import TIMINGS, stage
+    with stage('encode'):
+        z = encoder.encode(images)
+
+    print(TIMINGS.report(budget=0.5))
+    TIMINGS.to_json('latency.json')
+
+Stages recorded by the modules of this directory:
+    read                    parsing or memory-mapping a CSV recording
+    slice                   window scheduling (get_window_indices)
+    resample                resampling of the windows
+    feature.<name>          each selected feature, with the intermediates it
+                            is the first to need
+    acquire.drain           draining and checking a board block (acquisition)
+    acquire                 writing a pushed block into the ring buffer
+    stream.window           one live feature vector, from ring buffer to row
+    encode                  NumPy encoder forward pass (vae_encoder)
+    export.encode           batched encoder pass of sc_export
+    emit                    sending an OSC event
+
+The stream.window stage is the one to compare with the hop budget (half a
+period, 500 ms by default) for real-time feedback.
+"""
+import json
+import math
+import time
+
+# Histogram buckets: BUCKETS_PER_DECADE log-spaced buckets from MIN_SECONDS,
+# i.e. a relative resolution of about 6%, over NDECADES decades
+MIN_SECONDS = 1e-6
+BUCKETS_PER_DECADE = 40
+NDECADES = 8
+
+
+class LatencyHistogram:
+    """
+    Histogram of durations in log-spaced buckets, with exact count, total,
+    minimum and maximum. Percentiles are estimated to the bucket resolution.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (BUCKETS_PER_DECADE * NDECADES + 1)
+        self.count = 0
+        self.total = 0.
+        self.min = math.inf
+        self.max = 0.
+
+    def record(self, seconds):
+        if seconds > MIN_SECONDS:
+            i = min(int(math.log10(seconds / MIN_SECONDS) * BUCKETS_PER_DECADE) + 1,
+                    len(self.counts) - 1)
+        else:
+            i = 0
+        self.counts[i] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """
+        Returns an estimate of the q-th percentile (0-100), in seconds.
+        """
+        if not self.count:
+            return math.nan
+        rank = q / 100. * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            cumulative += n
+            if cumulative >= rank and n:
+                # Geometric centre of the bucket, within the observed range
+                centre = MIN_SECONDS * 10 ** ((i - 0.5) / BUCKETS_PER_DECADE) if i else MIN_SECONDS
+                return min(max(centre, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        """
+        Returns a dict with count, mean, min, p50, p95, p99 and max (ms).
+        """
+        if not self.count:
+            return {'count': 0}
+        ret = {'count': self.count, 'mean': 1e3 * self.total / self.count, 'min': 1e3 * self.min}
+        for q in (50, 95, 99):
+            ret['p%d' % q] = 1e3 * self.percentile(q)
+        ret['max'] = 1e3 * self.max
+        return ret
+
+
+class _Stage:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.record(time.perf_counter() - self.start)
+
+
+class _NoStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+class Timings:
+    """
+    Latency histograms of named pipeline stages.
+
+    Parameters:
+        enabled (bool): when False, stage() returns a no-op context manager
+            and nothing is recorded
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.histograms = {}
+
+    def histogram(self, name):
+        h = self.histograms.get(name)
+        if h is None:
+            h = self.histograms[name] = LatencyHistogram()
+        return h
+
+    def stage(self, name):
+        """
+        Returns a context manager that records the time spent in its block
+        under name.
+        """
+        if not self.enabled:
+            return _NO_STAGE
+        return _Stage(self.histogram(name))
+
+    def record(self, name, seconds):
+        """
+        Records a duration measured elsewhere (e.g. an end-to-end latency).
+        """
+        if self.enabled:
+            self.histogram(name).record(seconds)
+
+    def reset(self):
+        self.histograms.clear()
+
+    def summary(self):
+        """
+        Returns {stage: LatencyHistogram.summary()} for every recorded stage.
+        """
+        return {name: h.summary() for name, h in sorted(self.histograms.items())}
+
+    def to_json(self, file_path=None, **extra):
+        """
+        Returns the summary as a JSON string, and writes it to file_path if
+        given. Keyword arguments are added to the document (e.g. settings).
+        """
+        doc = dict(extra, unit='ms', stages=self.summary())
+        text = json.dumps(doc, indent=2, sort_keys=True)
+        if file_path is not None:
+            with open(file_path, 'w') as f:
+                f.write(text + '\n')
+        return text
+
+    def report(self, budget=None):
+        """
+        Returns a table of the stages. With a budget (s), the stages whose p99
+        exceeds it are flagged.
+        """
+        lines = ['%-24s %8s %9s %9s %9s %9s %9s' % ('stage', 'count', 'mean', 'p50', 'p95',
+                                                  'p99', 'max')]
+        for name, s in self.summary().items():
+            if not s['count']:
+                continue
+            line = '%-24s %8d %9.3f %9.3f %9.3f %9.3f %9.3f' % (
+                name, s['count'], s['mean'], s['p50'], s['p95'], s['p99'], s['max'])
+            if budget is not None and s['p99'] > 1e3 * budget:
+                line += '  over budget'
+            lines.append(line)
+        return '\n'.join(lines)
+
+
+# Process-wide timings used by the pipeline modules
+TIMINGS = Timings()
+stage = TIMINGS.stage
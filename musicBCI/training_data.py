@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+###  Training data of the VAE, loaded without intermediate copies.
+
+The training matrix written by gen_train_matrix.py (feature columns followed
+by 'Label') is memory-mapped: a binary matrix store (--format binary, see
+matrix_store) directly, a CSV file through a .npy sidecar parsed once.
+Rows are MinMax-scaled batch by batch straight into float32 buffers, and
+every batch is exposed as an [N x 12 x 12 x 1] view of its buffer, which
+replaces the reshape_to_12 / moveaxis / astype chain of AE.ipynb:
+
+    data = TrainingData('testFeat.csv')
+    train, test = data.split(test_size=0.2, seed=8)
+    x_train, y_train = train.images()
+    vae.fit(train.dataset(batch_size=32), epochs=800)
+"""
+import numpy as np
+from eeg_feature_generation import load_csv_columns
+from matrix_store import MatrixStore, is_matrix_store
+
+IMAGE_SHAPE = (12, 12, 1)
+
+# Rows scaled at a time when fitting the scaler or materializing a split
+CHUNK_ROWS = 65536
+
+
+def load_training_matrix(file_path, cache=True, cache_dir=None, dtype=np.float64):
+    """
+    Returns the header and the data matrix (labels included) of a training
+    matrix file.
+
+    Parameters:
+        file_path (str): CSV file or matrix store written by
+            gen_train_matrix.py. A store is memory-mapped as it is, in the
+            dtype it was written with (the cache options and dtype only
+            apply to CSV files); its label must be the last column.
+        cache (bool): whether to read and write the binary sidecar
+        cache_dir (str): directory for the sidecar. Defaults to the directory
+            of the CSV file.
+        dtype (numpy.dtype): type of the returned matrix, e.g. numpy.float32
+            for a matrix written by gen_train_matrix.py --dtype float32
+
+    Returns:
+        list: column names
+        numpy.ndarray: 2D matrix (read-only memory map when it comes from the
+            sidecar)
+    """
+    if is_matrix_store(file_path):
+        store = MatrixStore(file_path)
+        if store.label_column is None:
+            raise ValueError('%s has no label column' % file_path)
+        if store.label_column != len(store.header) - 1:
+            raise ValueError('%s: the label is column %d, expected the last one (%d)'
+                             % (file_path, store.label_column, len(store.header) - 1))
+        return store.header, store.matrix
+
+    with open(file_path, 'r') as f:
+        header = f.readline().strip().split(',')
+    # The sidecar keeps the label column, unlike matrix_from_csv_file's
+    return header, load_csv_columns(file_path, keep_last=True, cache=cache, cache_dir=cache_dir,
+                                    suffix='.full.npy', dtype=dtype)
+
+
+class MinMaxScaling:
+    """
+    Column-wise scaling to [0, 1], as sklearn's MinMaxScaler: constant
+    columns are shifted to 0 rather than divided by zero.
+
+    Parameters:
+        data_min (numpy.ndarray): minimum of every column
+        data_max (numpy.ndarray): maximum of every column
+    """
+
+    def __init__(self, data_min, data_max):
+        self.data_min = np.asarray(data_min, dtype=np.float64)
+        self.data_max = np.asarray(data_max, dtype=np.float64)
+        data_range = self.data_max - self.data_min
+        data_range[data_range == 0] = 1.
+        self.scale = 1. / data_range
+
+    @classmethod
+    def fit(cls, matrix, chunk_rows=CHUNK_ROWS):
+        """
+        Fits the scaling to the columns of a (possibly memory-mapped) matrix,
+        reading it chunk by chunk.
+        """
+        data_min = np.full(matrix.shape[1], np.inf)
+        data_max = np.full(matrix.shape[1], -np.inf)
+        for start in range(0, len(matrix), chunk_rows):
+            chunk = matrix[start:start + chunk_rows]
+            np.fmin(data_min, np.nanmin(chunk, axis=0), out=data_min)
+            np.fmax(data_max, np.nanmax(chunk, axis=0), out=data_max)
+        return cls(data_min, data_max)
+
+    def transform(self, rows, out=None, decimals=None):
+        """
+        Scales rows into out (a new float32 array by default), optionally
+        rounded to a number of decimals.
+        """
+        if out is None:
+            out = np.empty(rows.shape, dtype=np.float32)
+        np.multiply(np.subtract(rows, self.data_min), self.scale, out=out, casting='unsafe')
+        if decimals is not None:
+            np.round(out, decimals, out=out)
+        return out
+
+
+class TrainingData:
+    """
+    Rows of a training matrix, scaled and shaped as VAE input images.
+
+    Parameters:
+        source (str/numpy.ndarray): training matrix CSV file or matrix store,
+            or a 2D matrix whose last column is the label
+        rows (numpy.ndarray): indices of the rows to use (all by default)
+        scaling (MinMaxScaling): fitted scaling. Defaults to one fitted on
+            every row of the matrix, as in AE.ipynb.
+        decimals (int): rounding applied after scaling (None to skip it)
+        dtype (numpy.dtype): type the matrix of a CSV source is kept in (see
+            load_training_matrix)
+    """
+
+    def __init__(self, source, rows=None, scaling=None, decimals=4, dtype=np.float64):
+        if isinstance(source, str):
+            self.header, self.matrix = load_training_matrix(source, dtype=dtype)
+        else:
+            self.matrix = source
+            self.header = None
+        nfeatures = self.matrix.shape[1] - 1
+        if nfeatures != int(np.prod(IMAGE_SHAPE)):
+            raise ValueError('%d features do not fit a %s image' % (nfeatures, IMAGE_SHAPE))
+        self.rows = np.arange(len(self.matrix)) if rows is None else np.asarray(rows)
+        self.scaling = scaling or MinMaxScaling.fit(self.matrix[:, :-1])
+        self.decimals = decimals
+
+    def __len__(self):
+        return len(self.rows)
+
+    def subset(self, rows):
+        """
+        Returns a TrainingData over some of these rows, sharing the matrix and
+        the scaling.
+        """
+        return TrainingData(self.matrix, self.rows[rows], self.scaling, self.decimals)
+
+    def split(self, test_size=0.2, seed=None):
+        """
+        Shuffles the rows and splits them into a training and a test set.
+        """
+        order = np.random.default_rng(seed).permutation(len(self.rows))
+        ntest = int(np.ceil(test_size * len(order)))
+        return self.subset(order[ntest:]), self.subset(order[:ntest])
+
+    def labels(self):
+        """
+        Returns the labels of the rows, as int64.
+        """
+        return self._take(self.rows, slice(-1, None)).ravel().astype(np.int64)
+
+    def _take(self, rows, columns):
+        # Contiguous rows are sliced from the memory map instead of gathered
+        if len(rows) and rows[-1] - rows[0] == len(rows) - 1 and np.all(np.diff(rows) == 1):
+            return self.matrix[rows[0]:rows[-1] + 1, columns]
+        return self.matrix[rows, columns]
+
+    def _batch(self, rows):
+        x = self.scaling.transform(self._take(rows, slice(None, -1)), decimals=self.decimals)
+        y = self._take(rows, slice(-1, None)).ravel().astype(np.int64)
+        return x.reshape((-1,) + IMAGE_SHAPE), y
+
+    def images(self):
+        """
+        Returns all the rows as one [N x 12 x 12 x 1] float32 array, and their
+        labels. The scaled values are written once, chunk by chunk.
+        """
+        out = np.empty((len(self.rows), int(np.prod(IMAGE_SHAPE))), dtype=np.float32)
+        for start in range(0, len(self.rows), CHUNK_ROWS):
+            rows = self.rows[start:start + CHUNK_ROWS]
+            self.scaling.transform(self._take(rows, slice(None, -1)), out[start:start + len(rows)],
+                                   self.decimals)
+        return out.reshape((-1,) + IMAGE_SHAPE), self.labels()
+
+    def batches(self, batch_size=32, shuffle=False, seed=None, with_labels=False):
+        """
+        Yields the rows as [batch_size x 12 x 12 x 1] float32 batches (the last
+        one may be shorter), with their labels if with_labels is set.
+        """
+        rows = self.rows
+        if shuffle:
+            rows = rows[np.random.default_rng(seed).permutation(len(rows))]
+        for start in range(0, len(rows), batch_size):
+            x, y = self._batch(rows[start:start + batch_size])
+            yield (x, y) if with_labels else x
+
+    def dataset(self, batch_size=32, shuffle=True, seed=None, with_labels=False):
+        """
+        Returns a tf.data.Dataset of the batches, prefetched in the background.
+        A new shuffle is drawn on every epoch.
+        """
+        import tensorflow as tf
+        image = tf.TensorSpec((None,) + IMAGE_SHAPE, tf.float32)
+        label = tf.TensorSpec((None,), tf.int64)
+        rng = np.random.default_rng(seed)
+
+        def generator():
+            return self.batches(batch_size, shuffle, rng.integers(2 ** 32), with_labels)
+
+        dataset = tf.data.Dataset.from_generator(
+            generator, output_signature=(image, label) if with_labels else image)
+        return dataset.prefetch(tf.data.AUTOTUNE)
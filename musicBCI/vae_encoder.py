@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+###  TensorFlow-free inference of the trained VAE encoder.
+
+The encoder built in AE.ipynb is two Conv2D layers (3x3, stride 2, same
+padding, ReLU), a Dense(16) ReLU layer and the z_mean / z_log_var Dense
+heads. Its weights are exported once to a small .npz file:
+
+    python vae_encoder.py ../saved_weights/trained_vae encoder.npz
+
+after which the live path only needs NumPy:
+
+    encoder = load_encoder('encoder.npz')
+    z_mean = encoder.encode(images)
+
+NumpyEncoder.predict mirrors keras.Model.predict on the encoder, so it can
+be passed to sc_export.write_sc_params_to_file in place of the Keras model.
+"""
+import argparse
+import numpy as np
+from timing import stage
+
+# Layers of the encoder, in the order Keras tracks them in the checkpoint
+# (encoder/layer_with_weights-<i>)
+ENCODER_LAYERS = ('conv_0', 'conv_1', 'dense', 'z_mean', 'z_log_var')
+CONV_STRIDES = 2
+
+
+def _checkpoint_key(index, name):
+    return 'encoder/layer_with_weights-%d/%s/.ATTRIBUTES/VARIABLE_VALUE' % (index, name)
+
+
+def export_checkpoint(checkpoint_path, file_path):
+    """
+    Exports the encoder weights of a VAE checkpoint saved with
+    vae.save_weights (e.g. saved_weights/trained_vae) to a .npz file.
+
+    Reading the checkpoint needs TensorFlow, but not the model definition.
+    """
+    import tensorflow as tf
+    reader = tf.train.load_checkpoint(checkpoint_path)
+    weights = {}
+    for i, layer in enumerate(ENCODER_LAYERS):
+        for name in ('kernel', 'bias'):
+            weights[layer + '_' + name] = reader.get_tensor(_checkpoint_key(i, name))
+    _save(file_path, weights)
+
+
+def export_encoder(encoder, file_path):
+    """
+    Exports the weights of a Keras encoder model built as in AE.ipynb to a
+    .npz file.
+    """
+    arrays = encoder.get_weights()
+    if len(arrays) != 2 * len(ENCODER_LAYERS):
+        raise ValueError('expected %d weight arrays, got %d' % (2 * len(ENCODER_LAYERS), len(arrays)))
+    names = [layer + '_' + name for layer in ENCODER_LAYERS for name in ('kernel', 'bias')]
+    _save(file_path, dict(zip(names, arrays)))
+
+
+def _save(file_path, weights):
+    np.savez(file_path, **{k: np.asarray(v, dtype=np.float32) for k, v in weights.items()})
+
+
+def conv2d_same(x, kernel, bias, strides=CONV_STRIDES):
+    """
+    2D convolution with "same" padding, as computed by Keras' Conv2D.
+
+    Parameters:
+        x (numpy.ndarray): [N x H x W x Cin] input
+        kernel (numpy.ndarray): [kh x kw x Cin x Cout] kernel
+        bias (numpy.ndarray): Cout biases
+        strides (int): stride along both spatial axes
+
+    Returns:
+        numpy.ndarray: [N x ceil(H / strides) x ceil(W / strides) x Cout] output
+    """
+    n, h, w, _ = x.shape
+    kh, kw, _, cout = kernel.shape
+    oh = -(-h // strides)
+    ow = -(-w // strides)
+    # TensorFlow pads the extra row/column at the bottom/right
+    ph = max((oh - 1) * strides + kh - h, 0)
+    pw = max((ow - 1) * strides + kw - w, 0)
+    x = np.pad(x, ((0, 0), (ph // 2, ph - ph // 2), (pw // 2, pw - pw // 2), (0, 0)))
+
+    # One matrix product per kernel tap over the strided input views
+    out = np.broadcast_to(bias, (n, oh, ow, cout)).copy()
+    for i in range(kh):
+        for j in range(kw):
+            view = x[:, i:i + strides * oh:strides, j:j + strides * ow:strides, :]
+            out += view @ kernel[i, j]
+    return out
+
+
+class NumpyEncoder:
+    """
+    Forward pass of the VAE encoder in NumPy.
+
+    Parameters:
+        weights (dict): '<layer>_kernel' and '<layer>_bias' arrays for every
+            layer of ENCODER_LAYERS
+        seed (int): seed of the noise used to sample z in predict
+    """
+
+    def __init__(self, weights, seed=None):
+        self.weights = {k: np.asarray(v, dtype=np.float32) for k, v in weights.items()}
+        self.rng = np.random.default_rng(seed)
+
+    def hidden(self, images):
+        """
+        Returns the output of the Dense(16) layer for [N x 12 x 12] or
+        [N x 12 x 12 x 1] images.
+        """
+        w = self.weights
+        x = np.asarray(images, dtype=np.float32)
+        if x.ndim == 3:
+            x = x[..., np.newaxis]
+        x = np.maximum(conv2d_same(x, w['conv_0_kernel'], w['conv_0_bias']), 0)
+        x = np.maximum(conv2d_same(x, w['conv_1_kernel'], w['conv_1_bias']), 0)
+        x = x.reshape(len(x), -1)
+        return np.maximum(x @ w['dense_kernel'] + w['dense_bias'], 0)
+
+    def encode(self, images):
+        """
+        Returns the [N x latent_dim] z_mean of the images.
+        """
+        w = self.weights
+        with stage('encode'):
+            return self.hidden(images) @ w['z_mean_kernel'] + w['z_mean_bias']
+
+    def predict(self, images, batch_size=None, verbose=0):
+        """
+        Returns [z_mean, z_log_var, z] like the Keras encoder, z being sampled
+        from N(z_mean, exp(z_log_var)).
+        """
+        w = self.weights
+        with stage('encode'):
+            x = self.hidden(images)
+            z_mean = x @ w['z_mean_kernel'] + w['z_mean_bias']
+            z_log_var = x @ w['z_log_var_kernel'] + w['z_log_var_bias']
+            epsilon = self.rng.standard_normal(z_mean.shape).astype(np.float32)
+            z = z_mean + np.exp(0.5 * z_log_var) * epsilon
+        return [z_mean, z_log_var, z]
+
+
+def load_encoder(file_path, seed=None):
+    """
+    Loads an encoder exported by export_checkpoint or export_encoder.
+    """
+    with np.load(file_path, allow_pickle=False) as f:
+        weights = {k: f[k] for k in f.files}
+    return NumpyEncoder(weights, seed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Exports the VAE encoder weights of a checkpoint to .npz.')
+    parser.add_argument('checkpoint', help='checkpoint prefix, e.g. saved_weights/trained_vae')
+    parser.add_argument('output_file')
+    args = parser.parse_args()
+    export_checkpoint(args.checkpoint, args.output_file)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import numpy as np
+from acquisition import Acquisition, FakeBoard, PACKAGE_MODULO
+
+
+def _block(board, packages, timestamps):
+    data = np.zeros((board.timestamp_channel + 1, len(packages)))
+    data[board.package_num_channel] = np.asarray(packages) % PACKAGE_MODULO
+    data[board.timestamp_channel] = timestamps
+    return data
+
+
+def test_check_counts_large_gaps():
+    board = FakeBoard()
+    acquisition = Acquisition(board)
+    # Three gaps of 100 lost packages: their sum wraps past PACKAGE_MODULO
+    packages = [0, 101, 202, 303]
+    timestamps, _ = acquisition._check(_block(board, packages, np.arange(4.)))
+    assert len(timestamps) == 4
+    assert acquisition.dropped == 300
+
+    # The gap across two drained blocks is counted too
+    acquisition._check(_block(board, [350, 351], [4., 5.]))
+    assert acquisition.dropped == 300 + 46
+
+
+def test_check_discards_repeated_packages():
+    board = FakeBoard()
+    acquisition = Acquisition(board)
+    timestamps, _ = acquisition._check(_block(board, [5, 6, 6, 7, 9], np.arange(5.)))
+    np.testing.assert_array_equal(timestamps, [0., 1., 3., 4.])
+    assert (acquisition.received, acquisition.duplicated, acquisition.dropped) == (4, 1, 1)
+
+    assert acquisition._check(_block(board, [9], [5.])) is None
+    assert (acquisition.received, acquisition.duplicated, acquisition.dropped) == (4, 2, 1)
+
+
+def test_check_keeps_tied_timestamps():
+    board = FakeBoard()
+    acquisition = Acquisition(board)
+    timestamps, _ = acquisition._check(_block(board, [0, 1, 2, 3], [0., 1., 1., 2.]))
+    np.testing.assert_array_equal(timestamps, [0., 1., 1., 2.])
+    timestamps, _ = acquisition._check(_block(board, [4, 4, 6], [2., 2., 3.]))
+    np.testing.assert_array_equal(timestamps, [2., 3.])
+    # Every package is counted once: 0-6 once each, plus the repeated 4
+    assert (acquisition.received, acquisition.dropped, acquisition.duplicated) == (6, 1, 1)
+    assert acquisition.received + acquisition.dropped + acquisition.duplicated == 8
+
+
+def test_received_and_dropped_cover_the_stream():
+    board = FakeBoard(loss_rate=0.5, seed=3)
+    acquisition = Acquisition(board)
+    asyncio.run(acquisition.run(duration=1.))
+    assert acquisition.dropped > 0
+    assert acquisition.duplicated == 0
+    assert acquisition.received + acquisition.dropped == board._produced
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pywt
+import scipy.signal
+import pytest
+import eeg_feature_generation as efg
+from synthetic_eeg import SyntheticEEG, write_dataset_csv
+
+
+def _legacy_der(col, timestamps):
+    ret = []
+    for i in range(col.shape[0]):
+        der = 0
+        if i == 0:
+            der = (col[i + 1] - col[i]) / (timestamps[i + 1] - timestamps[i])
+        elif i == (len(col) - 1):
+            if not timestamps[i] - timestamps[i - 1] == 0:
+                der = (col[i] - col[i - 1]) / (timestamps[i] - timestamps[i - 1])
+        else:
+            if not timestamps[i + 1] - timestamps[i - 1] == 0:
+                der = (col[i + 1] - col[i - 1]) / (timestamps[i + 1] - timestamps[i - 1])
+        ret.append(der)
+    return ret
+
+
+def _legacy_complexity(mob_ret, timestamps):
+    # Kept as written originally, including the use of the index in place of
+    # the mobility at the edges
+    ret = []
+    for mob in range(len(mob_ret)):
+        dxV = 0
+        if mob == 0:
+            dxV = (mob_ret[1] - mob) / (timestamps[1] - timestamps[mob])
+        elif mob == len(mob_ret) - 1:
+            if not timestamps[mob] - timestamps[mob - 1] == 0:
+                dxV = (mob - mob_ret[mob - 1]) / (timestamps[mob] - timestamps[mob - 1])
+        else:
+            if not timestamps[mob + 1] - timestamps[mob - 1] == 0:
+                dxV = (mob_ret[mob + 1] - mob_ret[mob - 1]) / (timestamps[mob + 1] - timestamps[mob - 1])
+        ret.append(dxV / mob_ret[mob])
+    return ret
+
+
+def _legacy_feature_vector(matrix, state, timestamps):
+    # The per-window feature vector as computed before the batched engine,
+    # one feature function and one np.hstack at a time
+    nsignals = matrix.shape[1]
+    h1, h2 = np.split(matrix, [int(matrix.shape[0] / 2)])
+    q = np.split(matrix, [int(0.25 * matrix.shape[0]), int(0.50 * matrix.shape[0]),
+                          int(0.75 * matrix.shape[0])])
+    qm = [np.mean(x, axis=0) for x in q]
+    covM = np.cov(matrix.T)
+    details = [pywt.dwt(col, efg.WAVELET)[1] for col in matrix.T]
+    mob = [np.sqrt(np.var(_legacy_der(col, timestamps)) / np.var(col)) for col in matrix.T]
+
+    values = [np.mean(matrix, axis=0),
+              np.std(h2, axis=0, ddof=1) - np.std(h1, axis=0, ddof=1),
+              np.mean(h2, axis=0) - np.mean(h1, axis=0),
+              np.hstack(qm + [qm[i] - qm[j] for i in range(3) for j in range(i + 1, 4)]),
+              np.min(matrix, axis=0), np.min(h2, axis=0) - np.min(h1, axis=0),
+              np.max(matrix, axis=0), np.max(h2, axis=0) - np.max(h1, axis=0),
+              covM[np.triu_indices(nsignals)],
+              [round(np.nansum(np.log2(np.square(d))), 3) for d in details],
+              [round(-np.nansum(np.square(d) * np.log2(np.square(d))), 3) for d in details],
+              np.var(matrix, axis=0), mob, _legacy_complexity(mob, timestamps)]
+    names = ['mean_%d' % i for i in range(nsignals)]
+    names += ['std_d_h2h1_%d' % i for i in range(nsignals)]
+    names += ['mean_d_h2h1_%d' % i for i in range(nsignals)]
+    for i in range(4):
+        names += ['mean_q%d_%d' % (i + 1, j) for j in range(nsignals)]
+    for i in range(3):
+        for j in range(i + 1, 4):
+            names += ['mean_d_q%dq%d_%d' % (i + 1, j + 1, k) for k in range(nsignals)]
+    for prefix in ('min_', 'min_d_h2h1_', 'max_', 'max_d_h2h1_'):
+        names += [prefix + str(i) for i in range(nsignals)]
+    names += ['covM_%d_%d' % (i, j) for i in range(nsignals) for j in range(i, nsignals)]
+    for prefix in ('eng_', 'ent_', 'act_', 'mob_', 'comp_'):
+        names += [prefix + str(i) for i in range(nsignals)]
+    if state is not None:
+        values.append([state])
+        names.append('Label')
+    return np.hstack(values), names
+
+
+def _legacy_vectors_from_samples(file_path, nsamples, period, state):
+    # The sliding-window loop of generate_feature_vectors_from_samples as it
+    # was, for a recording without gaps
+    matrix = np.genfromtxt(file_path, delimiter=',')[1:, :-1]
+    t = 0.
+    previous, rows = None, []
+    while True:
+        rstart = matrix[0, 0] + t
+        index_0 = np.max(np.where(matrix[:, 0] <= rstart))
+        index_1 = np.max(np.where(matrix[:, 0] <= rstart + period))
+        s = matrix[index_0:index_1]
+        if len(s) == 0 or matrix[index_1, 0] - matrix[index_0, 0] < 0.9 * period:
+            break
+        ry, _ = scipy.signal.resample(s[:, 1:], num=nsamples, t=s[:, 0], axis=0)
+        t += 0.5 * period
+        r, headers = _legacy_feature_vector(ry, state, s[:, 0])
+        if previous is not None:
+            rows.append(np.hstack([previous, r]))
+        previous = r[:-1] if state is not None else r
+    return np.array(rows), ['lag1_' + s for s in headers[:-1]] + headers
+
+
+def _wavelet_columns(names):
+    return np.array([name.split('_')[0] in ('eng', 'ent') for name in names])
+
+
+def _assert_matches_legacy(actual, expected, names):
+    # Energy and entropy are rounded to 3 decimals, so a difference in the
+    # last bits may move them by one unit of the rounding
+    wavelet = _wavelet_columns(names)
+    np.testing.assert_allclose(actual[..., ~wavelet], expected[..., ~wavelet], rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(actual[..., wavelet], expected[..., wavelet], rtol=0, atol=1.001e-3)
+
+
+@pytest.fixture(scope='module')
+def recording(tmp_path_factory):
+    file_path = str(tmp_path_factory.mktemp('recording') / 'subject-neutral-1.csv')
+    generator = SyntheticEEG(4, 256., seed=7, dropout_rate=0., start_time=1.6e9)
+    write_dataset_csv(file_path, generator, 20.)
+    return file_path
+
+
+def test_feature_matrix_matches_legacy_vectors():
+    rng = np.random.default_rng(0)
+    windows = rng.standard_normal((6, 150, 4)).cumsum(axis=1)
+    timestamps = 1.6e9 + np.cumsum(rng.uniform(0.003, 0.005, (6, 160)), axis=1)
+    # Timestamps that do not advance take the zero-step branches
+    timestamps[1, 3] = timestamps[1, 2]
+    timestamps[2, 5:8] = timestamps[2, 4]
+
+    matrix, names = efg.generate_feature_matrix(windows, 1., timestamps)
+    for k in range(len(windows)):
+        expected, expected_names = _legacy_feature_vector(windows[k], 1., timestamps[k])
+        assert names == expected_names
+        _assert_matches_legacy(matrix[k], expected, names)
+
+
+def test_vectors_from_samples_match_legacy_loop(recording):
+    vectors, names = efg.generate_feature_vectors_from_samples(recording, 150, 1., state=1.)
+    expected, expected_names = _legacy_vectors_from_samples(recording, 150, 1., 1.)
+    assert names == expected_names
+    assert vectors.shape == expected.shape
+    _assert_matches_legacy(vectors, expected, names)
+
+
+def test_csv_sidecars(tmp_path, recording):
+    cache_dir = str(tmp_path)
+    parsed = efg.load_csv_columns(recording, keep_last=True, cache=False)
+    signals = efg.load_csv_columns(recording, cache_dir=cache_dir)
+    full = efg.load_csv_columns(recording, keep_last=True, cache_dir=cache_dir, suffix='.full.npy')
+    single = efg.load_csv_columns(recording, keep_last=True, cache_dir=cache_dir,
+                                  suffix='.full.npy', dtype=np.float32)
+    np.testing.assert_array_equal(signals, parsed[:, :-1])
+    np.testing.assert_array_equal(full, parsed)
+    assert single.dtype == np.float32
+    names = sorted(p.name for p in tmp_path.iterdir())
+    assert [name.split('.', 4)[-1] for name in names] == ['full.float32.npy', 'full.npy', 'npy']
+
+    # A new sidecar of the file replaces the stale one with the same suffix
+    # only, and later calls memory-map it
+    stale = '.'.join(names[2].split('.')[:-2] + ['0123456789abcdef', 'npy'])
+    (tmp_path / stale).write_bytes(b'')
+    (tmp_path / names[2]).unlink()
+    again = efg.load_csv_columns(recording, cache_dir=cache_dir)
+    assert isinstance(again, np.memmap)
+    assert sorted(p.name for p in tmp_path.iterdir()) == names
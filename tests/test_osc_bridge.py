@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import socket
+import struct
+import numpy as np
+import pytest
+from osc_bridge import OSCBridge, EVENT_DURATION, decode_packet, nrt_score
+
+
+@pytest.fixture
+def receiver():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(2.)
+    yield sock
+    sock.close()
+
+
+def test_send_round_trip(receiver):
+    with OSCBridge(port=receiver.getsockname()[1], latency=0.5) as bridge:
+        at = bridge.send(440., 0.25, 2)
+        [(unix_time, address, args)] = decode_packet(receiver.recv(4096))
+        assert address == '/bci/event'
+        assert args == [440., 0.25, 2]
+        # Time tags have a resolution of 2^-32 s, but the float conversion
+        # of an NTP time loses a few microseconds
+        assert unix_time == pytest.approx(at, abs=1e-5)
+
+
+def test_send_keeps_timestamp_spacing(receiver):
+    with OSCBridge(port=receiver.getsockname()[1], target='scsynth') as bridge:
+        first = bridge.send(220., 1., 0, timestamp=10.)
+        second = bridge.send(330., 0.5, 1, timestamp=10.5)
+        events = [decode_packet(receiver.recv(4096))[0] for _ in range(2)]
+    assert [address for _, address, _ in events] == ['/s_new', '/s_new']
+    assert events[1][2] == ['event', -1, 0, 1, 'freq', 330., 'amp', 0.5]
+    assert second - first == pytest.approx(0.5)
+    assert events[1][0] - events[0][0] == pytest.approx(0.5, abs=1e-5)
+
+
+def _split_score(score):
+    # An NRT score is a sequence of bundles, each prefixed by its size
+    packets, pos = [], 0
+    while pos < len(score):
+        size, = struct.unpack_from('>i', score, pos)
+        packets.append(score[pos + 4:pos + 4 + size])
+        pos += 4 + size
+    assert pos == len(score)
+    return packets
+
+
+def _score_time(packet):
+    # Score time tags are seconds from the start of the rendering, not NTP
+    # times, so they are read directly
+    return struct.unpack_from('>Q', packet, 8)[0] / float(1 << 32)
+
+
+def test_nrt_score():
+    freq = np.array([110., 220.5, 440.25])
+    amp = np.array([0.5, 1., 0.125])
+    packets = _split_score(nrt_score(freq, amp, interval=0.2, synthdef_path='event.scsyndef'))
+    assert len(packets) == len(freq) + 2
+
+    [(_, address, args)] = decode_packet(packets[0])
+    assert (address, args, _score_time(packets[0])) == ('/d_load', ['event.scsyndef'], 0.)
+
+    for i, packet in enumerate(packets[1:-1]):
+        [(_, address, args)] = decode_packet(packet)
+        assert address == '/s_new'
+        assert args == ['event', -1, 0, 0, 'freq', freq[i], 'amp', amp[i]]
+        assert _score_time(packet) == pytest.approx(i * 0.2, abs=1e-9)
+
+    [(_, address, args)] = decode_packet(packets[-1])
+    assert (address, args) == ('/c_set', [0, 0])
+    assert _score_time(packets[-1]) == pytest.approx(2 * 0.2 + EVENT_DURATION, abs=1e-9)
+
+
+def test_nrt_score_without_synthdef():
+    packets = _split_score(nrt_score([100.], [1.]))
+    assert [decode_packet(p)[0][1] for p in packets] == ['/s_new', '/c_set']
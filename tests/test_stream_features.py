@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from eeg_feature_generation import generate_feature_vectors_from_samples, matrix_from_csv_file
+from stream_features import StreamFeatureExtractor
+from synthetic_eeg import SyntheticEEG, write_dataset_csv
+
+
+@pytest.mark.parametrize('dropout_rate', [0., 0.2])
+def test_stream_matches_offline(tmp_path, dropout_rate):
+    file_path = str(tmp_path / 'subject-neutral-1.csv')
+    generator = SyntheticEEG(4, 256., seed=3, dropout_rate=dropout_rate, start_time=1.6e9)
+    write_dataset_csv(file_path, generator, 30.)
+    expected, names = generate_feature_vectors_from_samples(file_path, 150, 1., state=1.)
+
+    matrix = matrix_from_csv_file(file_path, cache=False)
+    extractor = StreamFeatureExtractor(4, 256., state=1.)
+    vectors = []
+    # Blocks of uneven sizes, as drained from a board
+    for block in np.array_split(matrix, np.cumsum(np.resize([37, 5, 120, 1], 200))):
+        vectors += extractor.push(block[:, 0], block[:, 1:])
+
+    assert extractor.names == names
+    # A window is only emitted once a sample past its end has arrived, so the
+    # last window of the recording is still pending
+    assert len(vectors) == len(expected) - 1
+    np.testing.assert_array_equal(np.array(vectors), expected[:-1])
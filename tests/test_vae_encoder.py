@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from vae_encoder import conv2d_same
+
+
+def _naive_conv2d_same(x, kernel, bias, strides):
+    # Direct loop over the outputs, with TensorFlow's "same" padding: the
+    # output has ceil(size / strides) rows and columns, and the odd padding
+    # row/column goes at the bottom/right
+    n, h, w, _ = x.shape
+    kh, kw, _, cout = kernel.shape
+    oh, ow = -(-h // strides), -(-w // strides)
+    top = max((oh - 1) * strides + kh - h, 0) // 2
+    left = max((ow - 1) * strides + kw - w, 0) // 2
+    out = np.zeros((n, oh, ow, cout))
+    for b in range(n):
+        for y in range(oh):
+            for z in range(ow):
+                out[b, y, z] = bias
+                for i in range(kh):
+                    for j in range(kw):
+                        row, col = y * strides + i - top, z * strides + j - left
+                        if 0 <= row < h and 0 <= col < w:
+                            out[b, y, z] += x[b, row, col] @ kernel[i, j]
+    return out
+
+
+@pytest.mark.parametrize('shape, kernel_size, strides', [
+    ((12, 12), 3, 2),
+    ((6, 6), 3, 2),
+    ((13, 11), 3, 2),
+    ((12, 12), 4, 2),
+    ((7, 5), 3, 1),
+])
+def test_conv2d_same_matches_naive_loop(shape, kernel_size, strides):
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((2,) + shape + (3,))
+    kernel = rng.standard_normal((kernel_size, kernel_size, 3, 5))
+    bias = rng.standard_normal(5)
+    out = conv2d_same(x, kernel, bias, strides)
+    assert out.shape == (2, -(-shape[0] // strides), -(-shape[1] // strides), 5)
+    np.testing.assert_allclose(out, _naive_conv2d_same(x, kernel, bias, strides),
+                               rtol=1e-12, atol=1e-12)